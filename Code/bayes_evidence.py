@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Empirical Bayes (type-II maximum likelihood) estimation of alpha and beta.
+
+Instead of the joint minimizer of J over (x, alpha, beta), alpha and beta
+maximize the evidence, the likelihood of y_delta with x integrated out,
+
+    log p(y | alpha, beta) = m/2 log(alpha) + 1/2 log det(beta L^T L)
+                             - 1/2 log det(H) - alpha/2 ||Ax - y||^2
+                             - beta/2 ||Lx||^2 - m/2 log(2 pi),
+
+with H = alpha A^T A + beta L^T L and x = alpha H^-1 A^T y, times the gamma
+hyperpriors of J. Setting its derivatives to zero gives the fixed point
+updates of MacKay,
+
+    alpha = (m - gamma + 2(a_0 - 1)) / (||Ax - y||^2 + 2 b_0)
+    beta  = (gamma + 2(a_1 - 1)) / (||Lx||^2 + 2 b_1)
+
+where gamma = alpha trace(H^-1 A^T A) is the effective number of
+parameters. For dense A and square, invertible L the log determinant and
+gamma come from the SVD A L^-1 = U diag(s) W^T of
+bayes_param_choice.spectral_decomposition,
+
+    log det(H) = log det(L^T L) + sum log(alpha s^2 + beta)
+    gamma      = sum alpha s^2/(alpha s^2 + beta),
+
+in O(n) per evaluation. For other operators (sparse matrices, scipy
+LinearOperators) the log determinants are estimated by stochastic Lanczos
+quadrature and gamma by a Hutchinson estimate, using only products with
+A, A^T, L and L^T.
+"""
+
+
+import numpy as np
+from scipy.linalg import eigh_tridiagonal
+from scipy.sparse.linalg import LinearOperator, aslinearoperator, cg
+
+from bayes_param_choice import spectral_decomposition
+from bayes_reg import TRACE_COLUMNS
+
+
+
+
+
+def _log_evidence(m, n, alpha, beta, logdet_LtL, logdet_H, residual, penalty):
+
+    """
+    Returns log p(y | alpha, beta) from the log determinants of L^T L and H
+    and the squared norms ||Ax - y||^2 and ||Lx||^2 at the posterior mean.
+    """
+
+    return (m/2*np.log(alpha) + (1/2)*(n*np.log(beta) + logdet_LtL)
+            - (1/2)*logdet_H - alpha/2*residual - beta/2*penalty
+            - m/2*np.log(2*np.pi))
+
+
+
+
+
+def _lanczos_logdet(matvec, probes, steps=30):
+
+    """
+    Stochastic Lanczos quadrature estimate of log det(M) for a symmetric
+    positive definite M, given by matvec. For every probe z, steps Lanczos
+    iterations (at most the dimension n) started from z/||z|| give a
+    tridiagonal matrix with
+    eigenvalues theta and eigenvectors S, and
+    z^T log(M) z ~ ||z||^2 sum S[0]^2 log(theta). The estimate is the mean
+    over the probes.
+    """
+
+    steps = min(steps, probes.shape[1])
+    estimates = []
+    for z in probes:
+        Q = [z/np.linalg.norm(z)]
+        diagonal, off_diagonal = [], []
+        for j in range(steps):
+            w = matvec(Q[-1])
+            diagonal.append(Q[-1]@w)
+            # full reorthogonalization, twice to keep Q orthogonal near a
+            # breakdown. steps is small
+            V = np.array(Q)
+            norm_before = np.linalg.norm(w)
+            w = w - V.T@(V@w)
+            w = w - V.T@(V@w)
+            norm = np.linalg.norm(w)
+            if j == steps - 1 or norm <= 1e-10*norm_before:
+                break
+            off_diagonal.append(norm)
+            Q.append(w/norm)
+
+        theta, S = eigh_tridiagonal(np.array(diagonal), np.array(off_diagonal))
+        estimates.append((z@z)*np.sum(S[0]**2*np.log(theta)))
+
+    return np.mean(estimates)
+
+
+
+
+
+def _spectral_terms(decomposition, uty, outside, alpha, beta):
+
+    """
+    Returns x, ||Ax - y||^2, ||Lx||^2, gamma, log det(L^T L) and log det(H)
+    at alpha and beta from the decomposition and uty = U^T y,
+    outside = ||(I - UU^T) y||^2. Everything but x costs O(n).
+    """
+
+    s = decomposition["s"]
+    L = decomposition["L"]
+    if "logdet_LtL" not in decomposition:
+        decomposition["logdet_LtL"] = 2*np.linalg.slogdet(L)[1]
+    if "LinvW" not in decomposition:
+        decomposition["LinvW"] = np.linalg.solve(L, decomposition["W"])
+
+    f = s**2/(s**2 + beta/alpha)
+    residual = np.sum(((1 - f)*uty)**2) + outside
+    penalty = np.sum((f/s*uty)**2)
+    gamma = np.sum(f)
+    logdet_H = (decomposition["logdet_LtL"] + np.sum(np.log(alpha*s**2 + beta))
+                + (L.shape[0] - len(s))*np.log(beta))
+    x = decomposition["LinvW"]@(f/s*uty)
+
+    return x, residual, penalty, gamma, decomposition["logdet_LtL"], logdet_H
+
+
+
+
+
+def _iterative_terms(state, alpha, beta):
+
+    """
+    Matrix-free version of _spectral_terms. x and the solves for the probes
+    are computed with CG, warm started from the previous call. The probes
+    are the same in every call, so the estimates are smooth in alpha and
+    beta.
+    """
+
+    A, L = state["A"], state["L"]
+    n = A.shape[1]
+    lmbd = beta/alpha
+    M = LinearOperator((n, n), dtype=float,
+                       matvec=lambda v: A.rmatvec(A.matvec(v)) + lmbd*L.rmatvec(L.matvec(v)))
+
+    state["x"], _ = cg(M, state["Aty"], x0=state["x"])
+    state["V"] = [cg(M, Atz, x0=v)[0] for Atz, v in zip(state["AtZ"], state["V"])]
+    if "logdet_LtL" not in state:
+        state["logdet_LtL"] = _lanczos_logdet(lambda v: L.rmatvec(L.matvec(v)),
+                                              state["probes"], state["steps"])
+
+    x = state["x"]
+    r = A.matvec(x) - state["y"]
+    Lx = L.matvec(x)
+    # trace(A M^-1 A^T) = alpha trace(H^-1 A^T A) = gamma
+    gamma = np.mean([Atz@v for Atz, v in zip(state["AtZ"], state["V"])])
+    logdet_H = n*np.log(alpha) + _lanczos_logdet(M.matvec, state["probes"], state["steps"])
+
+    return x, r@r, Lx@Lx, gamma, state["logdet_LtL"], logdet_H
+
+
+
+
+
+def evidence_maximization(A, L, y_delta, hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6],
+                          niter=1000, tol=1e-8, print_res=False,
+                          decomposition=None, n_probes=10, lanczos_steps=30,
+                          seed=0):
+
+    """
+    Maximizes the evidence times the hyperpriors over alpha and beta with
+    the fixed point updates of MacKay, x being the posterior mean
+    (A^T A + beta/alpha L^T L)^-1 A^T y at each alpha and beta.
+
+    Parameters
+    ----------
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    L : a matrix, a scipy.sparse matrix or a LinearOperator.
+        DESCRIPTION. L^T L has to be positive definite, e.g. getL, for the
+        prior of x to be proper.
+
+    y_delta : an array (y_0,....,y_n).
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
+    niter : integer, optional
+        DESCRIPTION. The default is 1000.
+
+    tol : a real number > 0, optional
+        DESCRIPTION. Stop once the relative changes of alpha and beta are
+        both below tol. The default is 1e-8.
+
+    print_res : Boolean, optional
+        DESCRIPTION. The default FALSE.
+
+    decomposition : dict, optional
+        DESCRIPTION. Output of spectral_decomposition(A, L), e.g. shared with
+        parameter_choice. Computed for dense A and L if None. The default is
+        None.
+
+    n_probes : integer, optional
+        DESCRIPTION. Number of Rademacher probe vectors of the stochastic
+        estimates for matrix-free operators. The default is 10.
+
+    lanczos_steps : integer, optional
+        DESCRIPTION. Lanczos iterations per probe of the log determinant
+        estimates. The default is 30.
+
+    seed : integer, optional
+        DESCRIPTION. Seed of the probe vectors. The default is 0.
+
+    Returns
+    -------
+    x : an array.
+        DESCRIPTION. The posterior mean at the final alpha and beta.
+
+    alpha : a real number > 0.
+
+    beta : a real number > 0.
+
+    evidence_list : a list.
+        DESCRIPTION. log p(y | alpha, beta) during all iterations.
+
+    data : a pandas data frame.
+        DESCRIPTION. The columns of Algorithm1-4, with J and its gradient
+        evaluated at (x, alpha, beta), and "evidence". The evidence and the
+        updates cost O(n) per iteration for dense problems, these columns
+        two products with A and L.
+
+    """
+
+    import pandas as pd
+
+    a_0, b_0, a_1, b_1 = hyper_priors
+    m = len(y_delta)
+    dense = (isinstance(A, np.ndarray) and isinstance(L, np.ndarray)
+             and L.shape[0] == L.shape[1])
+    if decomposition is None and dense:
+        decomposition = spectral_decomposition(A, L)
+
+    if decomposition is not None:
+        uty = decomposition["U"].T@y_delta
+        outside = max(y_delta@y_delta - uty@uty, 0)
+        terms = lambda alpha, beta: _spectral_terms(decomposition, uty, outside, alpha, beta)
+    else:
+        A = aslinearoperator(A)
+        L = aslinearoperator(L)
+        n = A.shape[1]
+        rng = np.random.default_rng(seed)
+        AtZ = [A.rmatvec(z) for z in rng.choice([-1.0, 1.0], size=(n_probes, m))]
+        state = {"A": A, "L": L, "y": y_delta, "Aty": A.rmatvec(y_delta),
+                 "x": np.zeros(n), "AtZ": AtZ, "V": [np.zeros(n) for _ in AtZ],
+                 "probes": rng.choice([-1.0, 1.0], size=(n_probes, n)),
+                 "steps": lanczos_steps}
+        terms = lambda alpha, beta: _iterative_terms(state, alpha, beta)
+
+    columns = {key: [] for key in TRACE_COLUMNS}
+    columns["evidence"] = []
+
+    def record(x, alpha, beta, residual, penalty, evidence):
+        # J and its partial derivatives, as in compute_gradient. partial_x J
+        # vanishes at the posterior mean up to the accuracy of the solve.
+        r = A@x - y_delta
+        partial_x = A.T@r + (beta/alpha)*(L.T@(L@x))
+        partial_alpha = (1/2*residual)-((m/2+a_0-1)/alpha)+b_0
+        partial_beta = (1/2*penalty)-((m/2+a_1-1)/beta)+b_1
+        obj = ((1/2)*alpha*residual - (m/2+a_0-1)*np.log(alpha) + b_0*alpha
+               + (1/2)*beta*penalty - (m/2+a_1-1)*np.log(beta) + b_1*beta)
+        row = {"x_norm": x@x, "alpha": alpha, "beta": beta,
+               "lambda": beta/alpha, "obj": obj, "J_x": partial_x@partial_x,
+               "J_alpha": partial_alpha**2, "J_beta": partial_beta**2,
+               "evidence": evidence}
+        for key in columns:
+            columns[key].append(row[key])
+
+    # initial guess as in Algorithm1-4
+    alpha = 10
+    beta = 1
+
+    for k in range(niter):
+        print(k, end = "\r")
+        x, residual, penalty, gamma, logdet_LtL, logdet_H = terms(alpha, beta)
+        n = len(x)
+        evidence = _log_evidence(m, n, alpha, beta, logdet_LtL, logdet_H, residual, penalty)
+        record(x, alpha, beta, residual, penalty, evidence)
+
+        alpha_new = (m - gamma + 2*(a_0 - 1)) / (residual + 2*b_0)
+        beta_new = (gamma + 2*(a_1 - 1)) / (penalty + 2*b_1)
+        change = max(abs(alpha_new - alpha)/alpha, abs(beta_new - beta)/beta)
+        alpha, beta = alpha_new, beta_new
+
+        if change < tol:
+            if print_res:
+                print('Successful')
+                print('Iterations:',k+1)
+                print('Change:',change)
+            break
+        elif k == niter-1:
+            print('Maximum number of iterations reached.')
+            print('Change:',change)
+
+    x, residual, penalty, gamma, logdet_LtL, logdet_H = terms(alpha, beta)
+    evidence = _log_evidence(m, len(x), alpha, beta, logdet_LtL, logdet_H, residual, penalty)
+    record(x, alpha, beta, residual, penalty, evidence)
+
+    data = pd.DataFrame({TRACE_COLUMNS.get(key, key): values for key, values in columns.items()})
+
+    return x, alpha, beta, columns["evidence"], data
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Coarse-to-fine solving on a hierarchy of grids.
+
+The algorithm is first run on a coarse grid, where A and L are small and
+iterations are cheap. Its x is interpolated to the next finer grid and,
+with alpha and beta, used as the initial guess there, so that only a few
+iterations are needed on the finest grid.
+"""
+
+
+from time import perf_counter
+
+import numpy as np
+
+from bayes_reg import getA, getL, Algorithm1, TRACE_COLUMNS
+
+
+
+
+
+def _default_operators(t):
+    return getA(t), getL(t)
+
+
+
+
+
+def _rescale(value, a, n_coarse, n_fine):
+
+    """
+    Carries alpha or beta from n_coarse to n_fine grid points. The closed form
+    update (n/2 + a - 1)/((1/2)||r||^2 + b) has a numerator that grows with n
+    and, for data sampled on the grid, a denominator that grows
+    proportionally to n, so only the - 1 + a terms need to be corrected.
+    """
+
+    return value*(n_fine/2 + a - 1)/(n_coarse/2 + a - 1)*n_coarse/n_fine
+
+
+
+
+
+def multilevel(t, y_delta, algorithm=Algorithm1, levels=3, coarse_niter=None,
+               niter=10000, tol=1e-5, operators=None,
+               hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6], **kwargs):
+
+    """
+    Runs algorithm from the coarsest to the finest grid, warm starting each
+    level with the result of the previous one.
+
+    Parameters
+    ----------
+    t : an array (t_0,...,t_n).
+        DESCRIPTION. The finest, uniform grid.
+
+    y_delta : an array (y_0,....,y_n).
+        DESCRIPTION. The data on t. The coarser levels use its values at
+        their grid points (linear interpolation if the grids do not nest).
+
+    algorithm : function, optional
+        DESCRIPTION. One of Algorithm1-4 or AlgorithmTV. The default is
+        Algorithm1.
+
+    levels : integer, optional
+        DESCRIPTION. Number of grids. Level l has (n-1)//2^l + 1 points, so
+        the grids nest when n-1 is divisible by 2^(levels-1). The coarsest
+        grid needs at least 2 points, so levels <= log2(n-1) + 1. The default
+        is 3.
+
+    coarse_niter : integer, optional
+        DESCRIPTION. Maximum number of iterations on the coarse levels. The
+        default is None, which means niter.
+
+    niter : integer, optional
+        DESCRIPTION. Maximum number of iterations on the finest level. The
+        default is 10000.
+
+    tol : integer, optional
+        DESCRIPTION. The default is 1e-5.
+
+    operators : function t -> (A, L), optional
+        DESCRIPTION. Builds the operators of a level, e.g. for sparse
+        operators or getD. The default is None, which means getA and getL.
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
+    **kwargs :
+        DESCRIPTION. Passed to algorithm on every level, e.g. mu for
+        Algorithm3.
+
+    Returns
+    -------
+    x : an array.
+        DESCRIPTION. An estimate for x_bar on t.
+
+    alpha : a real number > 0.
+
+    beta : a real number > 0.
+
+    obj_list : a list.
+        DESCRIPTION. The values of J on the finest level.
+
+    data : a pandas data frame.
+        DESCRIPTION. The trace of the finest level.
+
+    level_data : a pandas data frame.
+        DESCRIPTION. One row per level with its number of grid points,
+        iterations, run time in seconds (building the operators and solving)
+        and the final alpha, beta and lambda.
+
+    """
+
+    import pandas as pd
+
+    if operators is None:
+        operators = _default_operators
+    if coarse_niter is None:
+        coarse_niter = niter
+
+    a_0, b_0, a_1, b_1 = hyper_priors
+    n = len(t)
+    if levels < 1 or (n - 1)//2**(levels - 1) + 1 < 2:
+        raise ValueError("levels = %d needs 1 <= levels <= %d for %d grid points."
+                         % (levels, int(np.log2(max(n - 1, 1))) + 1, n))
+    sizes = [(n - 1)//2**level + 1 for level in reversed(range(levels))]
+
+    rows = []
+    init = None
+    t_prev = None
+    for level, n_level in zip(reversed(range(levels)), sizes):
+        start = perf_counter()
+        t_level = np.linspace(t[0], t[-1], n_level)
+        y_level = y_delta if n_level == n else np.interp(t_level, t, y_delta)
+        A, L = operators(t_level)
+
+        if t_prev is not None:
+            x, alpha, beta = init
+            init = (np.interp(t_level, t_prev, x),
+                    _rescale(alpha, a_0, len(t_prev), n_level),
+                    _rescale(beta, a_1, len(t_prev), n_level))
+
+        x, alpha, beta, obj_list, data = algorithm(
+            A, L, y_level, hyper_priors=hyper_priors,
+            niter=niter if level == 0 else coarse_niter, tol=tol, init=init,
+            **kwargs)[:5]
+
+        rows.append({"level": level, "n": n_level,
+                     "iterations": len(data) - 1,
+                     "time": perf_counter() - start,
+                     "alpha": alpha, "beta": beta,
+                     "lambda": data[TRACE_COLUMNS["lambda"]].iloc[-1]})
+        init = (x, alpha, beta)
+        t_prev = t_level
+
+    return x, alpha, beta, obj_list, data, pd.DataFrame(rows)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Classical choices of the regularization parameter lambda, to compare with
+the lambda = beta/alpha found by Algorithm1-4: generalized cross validation
+(GCV), the corner of the L-curve and the discrepancy principle.
+
+For dense A and square, invertible L (as from getA and getL) all criteria
+are evaluated from one decomposition. With the SVD A L^-1 = U diag(s) W^T
+and the filter factors f = s^2/(s^2 + lambda), the Tikhonov solution
+x = (A^T A + lambda L^T L)^-1 A^T y satisfies
+
+    ||Ax - y||^2 = sum ((1 - f) U^T y)^2 + ||(I - UU^T) y||^2
+    ||Lx||^2     = sum (f/s U^T y)^2
+    trace(H)     = sum f,      H = A (A^T A + lambda L^T L)^-1 A^T
+
+so each lambda costs O(n) after the O(n^3) decomposition. Other operators
+(sparse matrices, scipy LinearOperators) are handled matrix-free with CG and
+a stochastic (Hutchinson) estimate of trace(H).
+"""
+
+
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, aslinearoperator, cg
+
+from bayes_reg import TRACE_COLUMNS
+
+
+
+
+
+def spectral_decomposition(A, L):
+
+    """
+    Computes the SVD of A L^-1 used to evaluate the criteria in O(n) per
+    lambda. It only depends on A and L and can be reused for several data
+    vectors.
+
+    Parameters
+    ----------
+    A : a matrix m by n.
+
+    L : an invertible matrix n by n.
+
+    Returns
+    -------
+    decomposition : dict.
+        DESCRIPTION. Keys "U", "s", "W" (A L^-1 = U diag(s) W^T) and "L".
+
+    """
+
+    B = np.linalg.solve(L.T, A.T).T
+    U, s, Wt = np.linalg.svd(B, full_matrices=False)
+
+    return {"U": U, "s": s, "W": Wt.T, "L": L}
+
+
+
+
+
+def _spectral_path(decomposition, y_delta, lambdas):
+
+    """
+    Returns ||Ax - y||^2, ||Lx||^2 and trace(H) for every lambda, in O(n) per
+    lambda.
+    """
+
+    s = decomposition["s"]
+    uty = decomposition["U"].T@y_delta
+    outside = max(y_delta@y_delta - uty@uty, 0)
+
+    lambdas = np.asarray(lambdas, dtype=float)[:, None]
+    f = s**2/(s**2 + lambdas)
+    residual = np.sum(((1 - f)*uty)**2, axis=1) + outside
+    penalty = np.sum((f/s*uty)**2, axis=1)
+    trace = np.sum(f, axis=1)
+
+    return residual, penalty, trace
+
+
+
+
+
+def _iterative_path(A, L, y_delta, lambdas, n_probes=10, seed=0, rtol=1e-10):
+
+    """
+    Matrix-free version of _spectral_path. The solutions are computed with
+    CG, going from large to small lambda and warm starting every solve from
+    the previous lambda. The solves use a tight tolerance rtol, since with
+    the default one the warm start can already be accepted at small lambda,
+    which leaves the residual and penalty constant between neighbouring
+    lambdas. trace(H) is estimated with n_probes Rademacher vectors z as the
+    mean of (A^T z)^T (A^T A + lambda L^T L)^-1 A^T z, using the same vectors
+    for all lambdas so that the estimate is smooth in lambda.
+    """
+
+    A = aslinearoperator(A)
+    L = aslinearoperator(L)
+    n = A.shape[1]
+    Aty = A.rmatvec(y_delta)
+
+    rng = np.random.default_rng(seed)
+    AtZ = [A.rmatvec(z) for z in rng.choice([-1.0, 1.0], size=(n_probes, A.shape[0]))]
+
+    x = np.zeros(n)
+    V = [np.zeros(n) for _ in AtZ]
+    residual = np.zeros(len(lambdas))
+    penalty = np.zeros(len(lambdas))
+    trace = np.zeros(len(lambdas))
+
+    for i in np.argsort(lambdas)[::-1]:
+        lmbd = lambdas[i]
+        M = LinearOperator((n, n), dtype=float,
+                           matvec=lambda v: A.rmatvec(A.matvec(v)) + lmbd*L.rmatvec(L.matvec(v)))
+        x, _ = cg(M, Aty, x0=x, rtol=rtol)
+        V = [cg(M, Atz, x0=v, rtol=rtol)[0] for Atz, v in zip(AtZ, V)]
+
+        r = A.matvec(x) - y_delta
+        Lx = L.matvec(x)
+        residual[i] = r@r
+        penalty[i] = Lx@Lx
+        trace[i] = np.mean([Atz@v for Atz, v in zip(AtZ, V)])
+
+    return residual, penalty, trace
+
+
+
+
+
+def _curvature(lambdas, residual, penalty):
+
+    """
+    Curvature of the L-curve (log ||Ax - y||^2, log ||Lx||^2) along the
+    lambda path, by finite differences in log lambda. It is NaN at the end
+    points, where the differences are one-sided, and where the curve does
+    not move (speed about 0), where the quotient is 0/0.
+    """
+
+    t = np.log(lambdas)
+    rho = np.log(residual)
+    eta = np.log(penalty)
+    d_rho, d_eta = np.gradient(rho, t), np.gradient(eta, t)
+    dd_rho, dd_eta = np.gradient(d_rho, t), np.gradient(d_eta, t)
+
+    speed = d_rho**2 + d_eta**2
+    curvature = np.full(len(t), np.nan)
+    ok = speed > 1e-12*np.max(speed, initial=0)
+    ok[[0, -1]] = False
+    curvature[ok] = (d_rho*dd_eta - dd_rho*d_eta)[ok]/speed[ok]**(3/2)
+
+    return curvature
+
+
+
+
+
+def parameter_choice(A, L, y_delta, lambdas=None, sigma=None, tau=1.0,
+                     decomposition=None, traces=None, n_probes=10, seed=0):
+
+    """
+    Evaluates GCV, the L-curve and the discrepancy principle on a path of
+    lambdas and returns the lambda each of them chooses.
+
+    Parameters
+    ----------
+    A : a matrix or a scipy LinearOperator.
+
+    L : a matrix or a scipy LinearOperator.
+
+    y_delta : an array (y_0,....,y_n).
+
+    lambdas : array, optional
+        DESCRIPTION. The lambda path. The default is 200 values log-spaced
+        over the range of the squared singular values of A L^-1 for dense
+        A and square L and 100 values between 1e-8 and 1e2 otherwise.
+
+    sigma : a real number > 0, optional
+        DESCRIPTION. Noise level of y_delta. The discrepancy principle is only
+        evaluated if it is given. The default is None.
+
+    tau : a real number >= 1, optional
+        DESCRIPTION. Safety factor of the discrepancy principle, which picks
+        the largest lambda with ||Ax - y||^2 <= tau^2 n sigma^2. The default
+        is 1.
+
+    decomposition : dict, optional
+        DESCRIPTION. Output of spectral_decomposition, to reuse it for
+        several data vectors. The default is None.
+
+    traces : dict, optional
+        DESCRIPTION. Data frames returned by Algorithm1-4, by name. Their
+        final lambda is added to the summary so that it can be compared
+        with the classical choices. The default is None.
+
+    n_probes : integer, optional
+        DESCRIPTION. Number of probe vectors of the stochastic trace
+        estimate for matrix-free operators. The default is 10.
+
+    seed : integer, optional
+        DESCRIPTION. Seed of the probe vectors. The default is 0.
+
+    Returns
+    -------
+    path : a pandas data frame.
+        DESCRIPTION. One row per lambda with columns "lambda", "residual"
+        (||Ax - y||^2), "penalty" (||Lx||^2), "trace" (trace(H)), "gcv" and
+        "curvature" (of the L-curve).
+
+    summary : a pandas data frame.
+        DESCRIPTION. One row per method ("gcv", "lcurve", "discrepancy" and
+        the names in traces) with the chosen lambda and the criteria at it.
+
+    """
+
+    import pandas as pd
+
+    n = len(y_delta)
+    dense = (isinstance(A, np.ndarray) and isinstance(L, np.ndarray)
+             and L.shape[0] == L.shape[1])
+    if decomposition is None and dense:
+        decomposition = spectral_decomposition(A, L)
+
+    if lambdas is None:
+        if decomposition is not None:
+            s = decomposition["s"]
+            lo = max(s[-1]**2, 1e-16*s[0]**2)
+            lambdas = np.logspace(np.log10(lo), np.log10(s[0]**2), 200)
+        else:
+            lambdas = np.logspace(-8, 2, 100)
+    lambdas = np.sort(np.asarray(lambdas, dtype=float))
+
+    def evaluate(lambdas):
+        if decomposition is not None:
+            return _spectral_path(decomposition, y_delta, lambdas)
+        return _iterative_path(A, L, y_delta, lambdas, n_probes, seed)
+
+    residual, penalty, trace = evaluate(lambdas)
+    gcv = n*residual/(n - trace)**2
+    curvature = _curvature(lambdas, residual, penalty)
+
+    path = pd.DataFrame({"lambda": lambdas, "residual": residual,
+                         "penalty": penalty, "trace": trace, "gcv": gcv,
+                         "curvature": curvature})
+
+    # index on the path of the classical choices, -1 if there is none
+    choices = {"gcv": np.argmin(gcv),
+               "lcurve": np.nanargmax(curvature) if np.isfinite(curvature).any() else -1}
+    if sigma is not None:
+        below = np.flatnonzero(residual <= tau**2*n*sigma**2)
+        choices["discrepancy"] = below[-1] if below.size else -1
+    methods = list(choices)
+    chosen = np.array([lambdas[i] if i >= 0 else np.nan for i in choices.values()])
+    values = np.array([[column[i] if i >= 0 else np.nan for i in choices.values()]
+                       for column in (residual, penalty, trace)])
+
+    # the final lambdas of the traces, evaluated unless they are on the path
+    if traces:
+        extra = np.array([data[TRACE_COLUMNS["lambda"]].iloc[-1]
+                          for data in traces.values()], dtype=float)
+        extra_values = np.full((3, len(extra)), np.nan)
+        position = np.clip(np.searchsorted(lambdas, extra), 0, len(lambdas) - 1)
+        on_path = np.isfinite(extra) & (lambdas[position] == extra)
+        extra_values[:, on_path] = np.array([residual, penalty, trace])[:, position[on_path]]
+        off_path = np.isfinite(extra) & ~on_path
+        if off_path.any():
+            extra_values[:, off_path] = evaluate(extra[off_path])
+        methods += list(traces)
+        chosen = np.concatenate([chosen, extra])
+        values = np.concatenate([values, extra_values], axis=1)
+    summary = pd.DataFrame({"method": methods, "lambda": chosen,
+                            "residual": values[0], "penalty": values[1],
+                            "trace": values[2],
+                            "gcv": n*values[0]/(n - values[2])**2})
+
+    return path, summary
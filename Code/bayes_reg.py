@@ -11,12 +11,19 @@ Master Thesis Project Modules
 """
 
 
+# Only NumPy and SciPy are imported here so that the solvers can be used by
+# workers and scripts without paying for matplotlib, seaborn and pandas.
+# Those are imported inside the functions that need them.
+import importlib
+import json
+import os
+from functools import partial
+from time import perf_counter
+
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.sparse import dia_matrix
-from scipy.sparse.linalg import cg
-import pandas as pd
-import seaborn as sns
+from scipy.linalg import solveh_banded
+from scipy.sparse import dia_matrix, diags, issparse
+from scipy.sparse.linalg import LinearOperator, aslinearoperator, cg, splu
 
 
 
@@ -51,7 +58,55 @@ def getA(x):
 
 
 
-def getL(x):
+def getA_sparse(x, tol=1e-3):
+    
+    """
+    Sparse version of getA that drops the entries of A smaller than tol times
+    its largest entry. The kernel decays like |t-y|^(-3), so entries further
+    than about tol^(-1/3) apart are dropped and A becomes a banded matrix.
+    This only pays off on domains that are long compared to that distance.
+    Like getA it assumes a uniform grid, on which A is a Toeplitz matrix.
+
+    Parameters
+    ----------
+    x : an array (x_0,...,x_n).
+    
+    tol : a real number > 0, optional
+        DESCRIPTION. Relative tolerance, entries of A smaller than tol*h are
+        dropped. The default is 1e-3.
+
+    Returns
+    -------
+    A : a sparse matrix n by n (scipy.sparse.dia_matrix).
+    
+    err : a real number.
+        DESCRIPTION. Upper bound on the operator norm ||A - getA(x)||_2. 
+        The dropped part E is symmetric, so ||E||_2 <= ||E||_1, its largest
+        column sum.
+    """
+    
+    h = x[1] - x[0]
+    n = len(x)
+    #value of the kernel on the k-th diagonal
+    a = h/(1 + (h*np.arange(n))**2)**(3/2)
+    K = np.flatnonzero(a >= tol*h).max(initial=0)
+    
+    offsets = np.arange(-K, K + 1)
+    data = np.repeat(a[np.abs(offsets)][:, None], n, axis=1)
+    A = dia_matrix((data, offsets), shape=(n, n))
+    
+    #column sums of the dropped diagonals K+1,...,n-1 on both sides
+    dropped = np.concatenate([[0], np.cumsum(np.where(np.arange(n) > K, a, 0))])
+    j = np.arange(n)
+    err = np.max(dropped[j + 1] + dropped[n - j])
+    
+    return A, err
+
+
+
+
+
+def getL(x, sparse=False):
     
     """
     Given a function as an array this function computes the second order
@@ -60,6 +115,10 @@ def getL(x):
     Parameters
     ----------
     x : an array (x_0,...,x_n).
+    
+    sparse : Boolean, optional
+        DESCRIPTION. Return L as a scipy.sparse.dia_matrix instead of a dense
+        array. The default is False.
 
     Returns
     -------
@@ -73,7 +132,9 @@ def getL(x):
     data = np.array([ex, -2 * ex, ex])
     #one lower diag , main diag ,one upper diag
     offsets = np.array([-1, 0, 1])
-    L = (1/h**2)*dia_matrix((data, offsets), shape=(n, n)).toarray()
+    L = (1/h**2)*dia_matrix((data, offsets), shape=(n, n))
+    if not sparse:
+        L = L.toarray()
     
     return L
 
@@ -81,6 +142,72 @@ def getL(x):
 
 
 
+def getD(x, sparse=False):
+    
+    """
+    Given a function as an array this function computes the first order
+    (forward) finite difference matrix, used by the total variation penalty.
+
+    Parameters
+    ----------
+    x : an array (x_0,...,x_n).
+    
+    sparse : Boolean, optional
+        DESCRIPTION. Return D as a scipy.sparse.dia_matrix instead of a dense
+        array. The default is False.
+
+    Returns
+    -------
+    D : a matrix array n-1 by n
+    """
+    
+    h = x[1] - x[0]
+    n = len(x)
+    ex = np.ones(n)
+    #data matrix with r1=-1s, r2=1s
+    data = np.array([-ex, ex])
+    #main diag, one upper diag
+    offsets = np.array([0, 1])
+    D = (1/h)*dia_matrix((data, offsets), shape=(n - 1, n))
+    if not sparse:
+        D = D.toarray()
+    
+    return D
+
+
+
+
+
+def _as_operator(M):
+
+    """
+    Returns M itself if it is a NumPy array, a scipy.sparse matrix or a
+    scipy LinearOperator, and otherwise wraps it with aslinearoperator, so
+    that any object with shape, matvec and rmatvec can be used as A or L.
+    """
+
+    if isinstance(M, (np.ndarray, LinearOperator)) or issparse(M):
+        return M
+
+    return aslinearoperator(M)
+
+
+
+
+
+def _explicit(M):
+
+    """
+    True if M is stored as a matrix (dense or sparse), False for matrix-free
+    operators, which are only applied to vectors.
+    """
+
+    return isinstance(M, np.ndarray) or issparse(M)
+
+
+
+
+
 def J(A,L,x,alpha,beta,y,a_0,a_1,b_0,b_1):
     
     """
@@ -88,6 +215,10 @@ def J(A,L,x,alpha,beta,y,a_0,a_1,b_0,b_1):
 
     Parameters
     ----------
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    L : a matrix, a scipy.sparse matrix or a LinearOperator.
+
     x : an array (x_0,...,x_n).
     
     alpha : a real umber > 0.
@@ -109,6 +240,7 @@ def J(A,L,x,alpha,beta,y,a_0,a_1,b_0,b_1):
     Real number value of objective function.
 
     """
+    A, L = _as_operator(A), _as_operator(L)
     n = len(y)
     
     
@@ -132,9 +264,9 @@ def compute_gradient(A,L,beta,alpha,x,y,a_0,a_1,b_0,b_1):
 
     Parameters
     ----------
-    A : a matrix.
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
     
-    L : a matrix. 
+    L : a matrix, a scipy.sparse matrix or a LinearOperator.
 
     beta : a real number > 0.
     
@@ -155,512 +287,1364 @@ def compute_gradient(A,L,beta,alpha,x,y,a_0,a_1,b_0,b_1):
 
     Returns
     -------
-    sum_of_norms : real number
-        The squared norm of the gradient of the objective function.
+    sum_of_norms : real number
+        The squared norm of the gradient of the objective function.
+
+    """
+    A, L = _as_operator(A), _as_operator(L)
+    n = len(y)
+    r = A@x-y
+    Lx = L@x
+    partial_x = A.T@r+(beta/alpha)*(L.T@Lx)
+    partial_alpha = (1/2*np.linalg.norm(r)**2)-((n/2+a_0-1)/alpha)+b_0
+    partial_beta = (1/2*np.linalg.norm(Lx)**2)-((n/2+a_1-1)/beta)+b_1
+                   
+    sum_of_norms = np.linalg.norm(partial_x)**2+np.linalg.norm(partial_alpha)**2+np.linalg.norm(partial_beta)**2
+
+    return sum_of_norms
+
+
+
+
+
+
+
+
+# keys of one iteration record and the matching column names of the data
+# frame returned by the algorithms
+TRACE_COLUMNS = {"x_norm": "x_norm", "alpha": "alpha", "beta": "beta",
+                 "lambda": "lambda", "obj": "obj",
+                 "J_x": '$||\nabla_x J||$', "J_alpha": '$||\nabla_{a} J||$',
+                 "J_beta": '$||\nabla_{B} J||$'}
+
+
+
+
+
+def _to_frame(data_dict):
+
+    """
+    Builds the pandas data frame returned by the algorithms. pandas is only
+    imported here, on first use.
+    """
+    import pandas as pd
+
+    return pd.DataFrame.from_dict(data_dict)
+
+
+
+
+
+
+
+
+# =============================================================================
+# Alternating minimization engine
+#
+# Algorithm1-4 all alternate between an x-step and a hyperparameter step and
+# only differ in which steps they use. A step is a function
+#
+#     x_step(state, x, alpha, beta)      -> new x
+#     hyper_step(state, x, alpha, beta)  -> new alpha, new beta
+#
+# where state is the dict of the run (operators, data, hyper priors and
+# cached products). Steps must not modify x in place, since A@x - y and L@x
+# are cached for the last x they were computed for (see _residuals).
+# Step parameters such as step sizes are bound with functools.partial.
+# =============================================================================
+
+def _residuals(state, x):
+
+    """
+    Returns A@x - y and L@x. Both are cached for the last x, so the
+    hyperparameter step, the gradient step and the diagnostics of one
+    iteration share the same two matrix vector products.
+    """
+
+    if state["x"] is not x:
+        state["x"] = x
+        state["r"] = state["A"]@x - state["y"]
+        state["Lx"] = state["L"]@x
+        state["counts"]["matvec"] += 2
+
+    return state["r"], state["Lx"]
+
+
+
+
+
+def quadratic_penalty(Lx):
+    
+    """
+    The penalty (1/2)||Lx||^2 of methods 1-4. Returns its value and the
+    weights w = 1, see tv_penalty.
+    """
+    
+    return (1/2)*(Lx@Lx), 1
+
+
+
+
+
+def tv_penalty(Lx, eps=1e-3):
+    
+    """
+    The smoothed total variation penalty sum_i sqrt((Lx)_i^2 + eps^2), used
+    with L = getD(x). Returns its value and the weights
+    w = 1/sqrt((Lx)^2 + eps^2), with which its gradient is L^T (w Lx).
+    """
+    
+    s = np.sqrt(Lx**2 + eps**2)
+    
+    return np.sum(s), 1/s
+
+
+
+
+
+def _penalty(state, x):
+    
+    """
+    Returns the value of the penalty at x and its weights w, cached like
+    _residuals. The gradient of the penalty is L^T (w L x).
+    """
+    
+    r, Lx = _residuals(state, x)
+    if state["penalty_x"] is not x:
+        state["penalty_x"] = x
+        state["R"], state["w"] = state["penalty"](Lx)
+    
+    return state["R"], state["w"]
+
+
+
+
+
+def _normal_matrix(state, lmbd):
+
+    """
+    Returns A^T A + lmbd L^T L. The products A^T A and L^T L are computed on
+    first use and kept in state.
+    """
+
+    if "AtA" not in state:
+        state["AtA"] = state["A"].T@state["A"]
+    if "LtL" not in state:
+        state["LtL"] = state["L"].T@state["L"]
+
+    return state["AtA"] + lmbd*state["LtL"]
+
+
+
+
+
+def _upper_band(M, u):
+    
+    """
+    Returns the symmetric sparse matrix M in the upper banded storage used by
+    scipy.linalg.solveh_banded, with u diagonals above the main diagonal.
+    """
+    
+    ab = np.zeros((u + 1, M.shape[0]))
+    for k in range(u + 1):
+        ab[u - k, k:] = M.diagonal(k)
+    
+    return ab
+
+
+
+
+
+def _banded(state):
+    
+    """
+    Whether A^T A + L^T L, for sparse A and L, is banded enough for a banded
+    solve: its band storage, (u + 1) n numbers for bandwidth u, may be at
+    most a few times its number of nonzeros. This holds for getA_sparse and
+    getL(x, sparse=True), but not for sparse matrices with entries far from
+    the diagonal, whose band storage would be almost dense. The bandwidth
+    is computed once per run.
+    """
+    
+    if "AtA_band" in state:
+        return True
+    if "bandwidth" not in state:
+        _normal_matrix(state, 0)
+        M = (state["AtA"] + state["LtL"]).tocoo()
+        state["bandwidth"] = int(np.max(M.col - M.row, initial=0))
+        state["band_nnz"] = M.nnz
+    
+    return (state["bandwidth"] + 1)*state["AtA"].shape[0] <= 4*state["band_nnz"]
+
+
+
+
+
+def _normal_band(state, lmbd):
+    
+    """
+    Banded version of _normal_matrix for sparse A and L that are _banded.
+    The band storage of A^T A and L^T L is built once per run, so each new
+    lmbd only costs an O(n u) sum before the banded Cholesky solve.
+    """
+    
+    if "AtA_band" not in state:
+        _banded(state)
+        u = state["bandwidth"]
+        state["AtA_band"] = _upper_band(state["AtA"], u)
+        state["LtL_band"] = _upper_band(state["LtL"], u)
+    
+    return state["AtA_band"] + lmbd*state["LtL_band"]
+
+
+
+
+
+def _normal_operator(state, lmbd, w=None):
+
+    """
+    Returns A^T A + lmbd L^T W L, W = diag(w), as a LinearOperator for CG.
+    Without weights and for A and L stored as matrices it applies the matrix
+    of _normal_matrix. Otherwise L^T W L is applied through L, and A^T A
+    through A unless A is stored as a matrix, so matrix-free operators are
+    never formed. Every product with A, A^T, L, L^T or a stored normal
+    matrix is counted in state["counts"]["matvec"], so one application
+    counts 1, 3 or 4 products.
+    """
+
+    A, L, counts = state["A"], state["L"], state["counts"]
+    if w is None and _explicit(A) and _explicit(L):
+        N = _normal_matrix(state, lmbd)
+        apply = lambda v: N@v
+        products = 1
+    else:
+        if w is None:
+            w = 1
+        if _explicit(A):
+            if "AtA" not in state:
+                state["AtA"] = A.T@A
+            AtA = state["AtA"]
+            apply = lambda v: AtA@v + lmbd*(L.T@(w*(L@v)))
+            products = 3
+        else:
+            apply = lambda v: A.T@(A@v) + lmbd*(L.T@(w*(L@v)))
+            products = 4
+
+    def matvec(v):
+        counts["matvec"] += products
+        return apply(v)
+
+    return LinearOperator((state["n"], state["n"]), matvec=matvec, dtype=float)
+
+
+
+
+
+def _cg_solve(state, M, x):
+
+    """
+    Solves M x = A^T y with CG, warm started from x. Inner iterations are
+    counted in state["counts"]["cg_iter"] and solves that did not converge
+    in state["cg_failures"].
+    """
+
+    counts = state["counts"]
+
+    def count_iteration(xk):
+        counts["cg_iter"] += 1
+
+    x_new, info = cg(M, state["Aty"], x0=x, callback=count_iteration)
+    counts["solve"] += 1
+    if info != 0:
+        state["cg_failures"] += 1
+
+    return x_new
+
+
+
+
+
+def precompute(A, L):
+    
+    """
+    Computes the products of A and L the x-steps need, A^T A and L^T L, and
+    for sparse A and L their band storage. They only depend on the operators,
+    so the result can be passed as state to several runs with the same A
+    and L, or placed in shared memory with bayes_shared.share_operators.
+
+    Parameters
+    ----------
+    A : a matrix or a scipy.sparse matrix.
+    
+    L : a matrix or a scipy.sparse matrix. 
+
+    Returns
+    -------
+    ops : dict.
+        DESCRIPTION. Keys "AtA", "LtL" and, for banded sparse A and L,
+        "AtA_band" and "LtL_band". Empty if A or L is a LinearOperator, since the
+        x-steps are then matrix-free.
+
+    """
+    
+    state = {"A": A, "L": L}
+    if not (_explicit(A) and _explicit(L)):
+        return {}
+    _normal_matrix(state, 0)
+    if issparse(A) and issparse(L) and _banded(state):
+        _normal_band(state, 0)
+    
+    return {key: value for key, value in state.items()
+            if key not in ("A", "L", "bandwidth", "band_nnz")}
+
+
+
+
+
+def _diagnostics(state, x, alpha, beta):
+
+    """
+    Returns J and the squared norms of its partial derivatives in x, alpha
+    and beta at (x, alpha, beta). Their sum is the value of compute_gradient
+    for the quadratic penalty.
+    """
+
+    n = state["n"]
+    m = state["beta_shape"]
+    a_0, b_0, a_1, b_1 = state["a_0"], state["b_0"], state["a_1"], state["b_1"]
+    r, Lx = _residuals(state, x)
+    R, w = _penalty(state, x)
+    res = r@r
+
+    obj = (1/2)*alpha*res -(n/2+a_0-1)*np.log(alpha)+ b_0*alpha + beta*R-(m+a_1-1)*np.log(beta)+b_1*beta
+
+    partial_x = state["A"].T@r + (beta/alpha)*(state["L"].T@(w*Lx))
+    state["counts"]["matvec"] += 2
+    partial_alpha = (1/2*res)-((n/2+a_0-1)/alpha)+b_0
+    partial_beta = R-((m+a_1-1)/beta)+b_1
+
+    return obj, partial_x@partial_x, partial_alpha**2, partial_beta**2
+
+
+
+
+
+def solve_x_step(state, x, alpha, beta):
+
+    """
+    x-step of methods 1 and 2: the closed form solution
+    x = (A^T A + beta/alpha L^T L)^-1 A^T y. For sparse A and L (e.g. from
+    getA_sparse and getL(x, sparse=True)) the system is banded and is solved
+    with a banded Cholesky factorization in O(n u^2) for bandwidth u. Other
+    sparse systems are solved with a sparse LU factorization. If A or
+    L is a LinearOperator the system is solved matrix-free with CG, warm
+    started from the current x, unless state["normal_solve"] is given.
+    """
+
+    A, L = state["A"], state["L"]
+    lmbd = beta/alpha
+    if "normal_solve" in state:
+        state["counts"]["solve"] += 1
+        return state["normal_solve"](lmbd, state["Aty"])
+    if not (_explicit(A) and _explicit(L)):
+        return _cg_solve(state, _normal_operator(state, lmbd), x)
+
+    state["counts"]["solve"] += 1
+    if issparse(A) and issparse(L):
+        if _banded(state):
+            return solveh_banded(_normal_band(state, lmbd), state["Aty"])
+        return splu(_normal_matrix(state, lmbd).tocsc()).solve(state["Aty"])
+
+    return np.linalg.solve(np.asarray(_normal_matrix(state, lmbd)), state["Aty"])
+
+
+
+
+
+def cg_x_step(state, x, alpha, beta):
+
+    """
+    x-step of Algorithm4: solves the same system as solve_x_step with the
+    conjugate gradient method, warm started from the current x. The number
+    of CG solves that did not converge is counted in state["cg_failures"],
+    the inner CG iterations in state["counts"]["cg_iter"].
+    """
+
+    return _cg_solve(state, _normal_operator(state, beta/alpha), x)
+
+
+
+
+
+def gradient_x_step(state, x, alpha, beta, mu=1e-3):
+
+    """
+    x-step of method 3: one gradient step with step size mu,
+    x - mu*((A^T A + beta/alpha L^T L) x - A^T y).
+    """
+
+    r, Lx = _residuals(state, x)
+    R, w = _penalty(state, x)
+    g = state["A"].T@r + (beta/alpha)*(state["L"].T@(w*Lx))
+    state["counts"]["matvec"] += 2
+
+    return x - mu*g
+
+
+
+
+
+def irls_x_step(state, x, alpha, beta):
+
+    """
+    x-step for non-quadratic penalties such as tv_penalty: one iteratively
+    reweighted least squares (lagged diffusivity) step, which solves
+    (A^T A + beta/alpha L^T W L) x = A^T y with the weights W of the penalty
+    at the current x. For the quadratic penalty this is solve_x_step.
+
+    For sparse A and L the system has the same band as A^T A + L^T L. If
+    it is banded, the band storage of A^T A is reused and only the O(n)
+    weighted part changes between steps, otherwise it is solved with a
+    sparse LU factorization. For other A and L the system is solved
+    matrix-free with CG, warm started from the current x.
+    """
+
+    A, L = state["A"], state["L"]
+    lmbd = beta/alpha
+    r, Lx = _residuals(state, x)
+    R, w = _penalty(state, x)
+
+    if issparse(A) and issparse(L):
+        state["counts"]["solve"] += 1
+        LtWL = L.T@diags(w*np.ones(L.shape[0]))@L
+        if not _banded(state):
+            return splu((state["AtA"] + lmbd*LtWL).tocsc()).solve(state["Aty"])
+        _normal_band(state, lmbd)
+        ab = state["AtA_band"] + lmbd*_upper_band(LtWL, state["AtA_band"].shape[0] - 1)
+        return solveh_banded(ab, state["Aty"])
+
+    return _cg_solve(state, _normal_operator(state, lmbd, w), x)
+
+
+
+
+
+def closed_form_hyper_step(state, x, alpha, beta):
+
+    """
+    Closed form minimizers of J in alpha and beta for fixed x.
+    """
+
+    n = state["n"]
+    r, Lx = _residuals(state, x)
+    R, w = _penalty(state, x)
+    alpha = ((n/2)+state["a_0"]-1) / ((1/2)*(r@r) + state["b_0"])
+    beta  = (state["beta_shape"]+state["a_1"]-1) / (R + state["b_1"])
+
+    return alpha, beta
+
+
+
+
+
+def gradient_hyper_step(state, x, alpha, beta, mu_a=1e-3, mu_b=1e-3):
+
+    """
+    Hyperparameter step of method 2: one gradient step in alpha and beta
+    with step sizes mu_a and mu_b.
+    """
+
+    n = state["n"]
+    r, Lx = _residuals(state, x)
+    R, w = _penalty(state, x)
+    alpha = alpha - mu_a * ((1/2)*(r@r) + state["b_0"] - ((n/2+state["a_0"]-1)/alpha))
+    beta  = beta - mu_b * (R + state["b_1"] - ((state["beta_shape"]+state["a_1"]-1)/beta))
+
+    return alpha, beta
+
+
+
+
+
+def newton_hyper_step(state, x, alpha, beta):
+
+    """
+    One Newton step on partial_alpha J = 0 and partial_beta J = 0 for fixed x,
+    taken in log(alpha) and log(beta) so the iterates stay positive.
+    """
+
+    n = state["n"]
+    r, Lx = _residuals(state, x)
+    R, w = _penalty(state, x)
+    c_0 = n/2+state["a_0"]-1
+    c_1 = state["beta_shape"]+state["a_1"]-1
+    alpha = alpha*np.exp(1 - alpha*((1/2)*(r@r) + state["b_0"])/c_0)
+    beta  = beta*np.exp(1 - beta*(R + state["b_1"])/c_1)
+
+    return alpha, beta
+
+
+
+
+
+def _timed(times, phase, f, *args):
+    
+    """
+    Calls f(*args) and, if times is not None, appends its run time to
+    times[phase].
+    """
+    
+    if times is None:
+        return f(*args)
+    
+    start = perf_counter()
+    out = f(*args)
+    times[phase].append(perf_counter() - start)
+    
+    return out
+
+
+
+
+
+# phases timed per iteration and counters kept in state["counts"]
+PROFILE_PHASES = ["x_step", "hyper_step", "diagnostics", "bookkeeping"]
+PROFILE_COUNTS = ["matvec", "solve", "cg_iter"]
+
+
+
+
+
+def _profile_summary(times, counts):
+    
+    """
+    Summarizes the per-iteration timings and counts of a profiled run.
+    """
+    
+    per_iteration = dict(times)
+    per_iteration.update(counts)
+    
+    return {"iterations": len(times["x_step"]),
+            "time": {phase: float(np.sum(times[phase])) for phase in PROFILE_PHASES},
+            "counts": {key: int(np.sum(counts[key])) for key in PROFILE_COUNTS},
+            "per_iteration": _to_frame(per_iteration)}
+
+
+
+
+
+def _describe(f):
+
+    """
+    Describes a step or penalty function, possibly a functools.partial with
+    keyword arguments, by its module, name and keywords, so that it can be
+    stored in a checkpoint.
+    """
+
+    kwargs = {}
+    if isinstance(f, partial):
+        kwargs = dict(f.keywords)
+        f = f.func
+
+    return {"module": f.__module__, "name": f.__qualname__, "kwargs": kwargs}
+
+
+
+
+
+def _restore(description):
+
+    """
+    Inverse of _describe.
+    """
+
+    f = getattr(importlib.import_module(description["module"]), description["name"])
+
+    return partial(f, **description["kwargs"]) if description["kwargs"] else f
+
+
+
+
+
+def _save_checkpoint(path, config, x, alpha, beta, k, converged, columns, state):
+
+    """
+    Writes the run state after k iterations, and whether the run converged,
+    to path. The file is first
+    written next to path and then renamed, so a run killed while writing
+    leaves the previous checkpoint intact.
+    """
+
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, x=x, alpha=alpha, beta=beta, k=k, converged=converged,
+             cg_failures=state["cg_failures"],
+             counts=np.array([state["counts"][key] for key in PROFILE_COUNTS]),
+             config=json.dumps(config),
+             **{"column_" + key: np.array(values) for key, values in columns.items()})
+    os.replace(tmp, path)
+
+
+
+
+
+def load_checkpoint(path):
+
+    """
+    Reads a checkpoint written by alternating_minimization.
+
+    Returns
+    -------
+    checkpoint : dict.
+        DESCRIPTION. Keys "x", "alpha", "beta", "k" (number of iterations
+        done), "converged" (whether the run met its tolerance), "columns"
+        (the trace so far by TRACE_COLUMNS key),
+        "cg_failures", "counts" and "config" (the steps, penalty and
+        arguments of the run).
+
+    """
+
+    with np.load(path) as f:
+        return {"x": f["x"], "alpha": f["alpha"][()], "beta": f["beta"][()],
+                "k": int(f["k"]), "converged": bool(f["converged"]),
+                "cg_failures": int(f["cg_failures"]),
+                "counts": dict(zip(PROFILE_COUNTS, f["counts"].tolist())),
+                "columns": {key: f["column_" + key].tolist() for key in TRACE_COLUMNS},
+                "config": json.loads(str(f["config"]))}
+
+
+
+
+
+def alternating_minimization(A, L, y_delta, x_step, hyper_step,
+                             hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6],
+                             niter=10000, tol=1e-5, print_res=False,
+                             hyper_first=False, trace=None, state=None,
+                             profile=False, penalty=quadratic_penalty,
+                             beta_shape=None, init=None, checkpoint=None,
+                             checkpoint_every=100, resume_from=None):
+
+    """
+    Minimizes J by alternating an x-step and a hyperparameter step. This is
+    the loop behind Algorithm1-4 and AlgorithmTV, which only choose the
+    steps and the penalty.
+
+    A and L can be dense arrays, scipy.sparse matrices, scipy
+    LinearOperators or any object with shape, matvec and rmatvec. Dense and
+    sparse operators are solved directly, while for matrix-free operators
+    only products with A, A^T, L and L^T are used (the x-steps use CG) and
+    A^T A and L^T L are never formed.
+
+    Parameters
+    ----------
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    L : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    y_delta : an array (y_0,....,y_n).
+
+    x_step : function (state, x, alpha, beta) -> x.
+        DESCRIPTION. E.g. solve_x_step, cg_x_step or gradient_x_step.
+
+    hyper_step : function (state, x, alpha, beta) -> alpha, beta.
+        DESCRIPTION. E.g. closed_form_hyper_step, gradient_hyper_step or
+        newton_hyper_step.
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
+    niter : integer, optional
+        DESCRIPTION. The default is 10000.
+
+    tol : integer, optional
+        DESCRIPTION. The default is 1e-5.
+
+    print_res : Boolean, optional
+        DESCRIPTION. The default FALSE.
+
+    hyper_first : Boolean, optional
+        DESCRIPTION. Take the hyperparameter step before the x-step in each
+        iteration, as in method 3. The default is False.
+
+    trace : a trace sink, optional
+        DESCRIPTION. Object with append(record) and flush() methods, e.g.
+        bayes_trace.TraceWriter. Every iteration record is passed to it as
+        it is computed. The default is None.
+
+    state : dict, optional
+        DESCRIPTION. Dict the run state is kept in, e.g. to read
+        state["cg_failures"] afterwards. Products of A and L cached in it
+        (state["AtA"], state["LtL"]) are reused, so a state can be passed
+        to several runs with the same A and L. A function
+        state["normal_solve"](lmbd, b) returning (A^T A + lmbd L^T L)^-1 b,
+        e.g. from a factorization or a fast transform, is used by
+        solve_x_step instead of CG for matrix-free operators. The default
+        is None.
+
+    profile : Boolean or function, optional
+        DESCRIPTION. If True, time the x-step, hyperparameter step,
+        diagnostics and bookkeeping of every iteration and count the matrix
+        vector products, linear solves and inner CG iterations. The summary
+        is returned after data. If a function, it is also called with the
+        summary. The default is False.
+
+    penalty : function Lx -> (value, weights), optional
+        DESCRIPTION. The regularization term. The default is
+        quadratic_penalty, (1/2)||Lx||^2. See tv_penalty.
+
+    beta_shape : a real number, optional
+        DESCRIPTION. The power of beta in the normalizing constant of the
+        prior, n/2 for the quadratic penalty and the number of rows of L
+        for tv_penalty. The default is None, which means n/2.
+
+    init : tuple (x, alpha, beta), optional
+        DESCRIPTION. Initial guess, e.g. a warm start from a coarser grid.
+        The default is None, which means alpha = 10, beta = 1 and
+        x = c A^T y with c = ||A^T y||^2/||A A^T y||^2.
+
+    checkpoint : string, optional
+        DESCRIPTION. Path of a .npz file the run state (x, alpha, beta, the
+        iteration index, the trace so far, the counters and the steps of
+        the run) is written to every checkpoint_every iterations and at the
+        end, for resume. The default is None.
+
+    checkpoint_every : integer, optional
+        DESCRIPTION. The default is 100.
+
+    resume_from : dict, optional
+        DESCRIPTION. Output of load_checkpoint to continue from. See resume,
+        which also restores the steps and arguments of the run. The default
+        is None.
+
+    Returns
+    -------
+    x : an array.
+        DESCRIPTION. An estimate for x_bar.
+
+    alpha : a real number > 0.
+
+    beta : a real number > 0.
+
+    obj_list : a list.
+        DESCRIPTION. The values of J during all iterations.
+
+    data : a pandas data frame.
+
+    profile : dict.
+        DESCRIPTION. Only returned if profile is set. Keys "iterations",
+        "time" (total seconds per phase), "counts" (totals) and
+        "per_iteration" (a data frame with one row per iteration).
+
+    """
+
+    A, L = _as_operator(A), _as_operator(L)
+    n = len(y_delta)
+    a_0, b_0, a_1, b_1 = hyper_priors
+    if beta_shape is None:
+        beta_shape = n/2
+
+    if state is None:
+        state = {}
+    state.update({"A": A, "L": L, "y": y_delta, "n": n,
+                  "a_0": a_0, "b_0": b_0, "a_1": a_1, "b_1": b_1,
+                  "penalty": penalty, "beta_shape": beta_shape,
+                  "Aty": A.T@y_delta, "x": None, "penalty_x": None,
+                  "cg_failures": 0,
+                  "counts": {key: 0 for key in PROFILE_COUNTS}})
+    state["counts"]["matvec"] += 1
+
+    if checkpoint is not None:
+        config = {"x_step": _describe(x_step), "hyper_step": _describe(hyper_step),
+                  "penalty": _describe(penalty), "hyper_priors": list(hyper_priors),
+                  "niter": niter, "tol": tol, "hyper_first": hyper_first,
+                  "beta_shape": beta_shape}
+
+    # initial guess
+    start = 0
+    converged = False
+    if resume_from is not None:
+        x = np.array(resume_from["x"], dtype=float)
+        alpha = resume_from["alpha"]
+        beta = resume_from["beta"]
+        start = resume_from["k"]
+        converged = resume_from["converged"]
+        state["cg_failures"] = resume_from["cg_failures"]
+        state["counts"].update(resume_from["counts"])
+    elif init is None:
+        alpha = 10
+        beta = 1
+        Aty = state["Aty"]
+        c = np.linalg.norm(Aty)**2 / np.linalg.norm(A@Aty)**2
+        x = c*Aty
+        state["counts"]["matvec"] += 1
+    else:
+        x, alpha, beta = init
+        x = np.asarray(x, dtype=float)
+
+    if resume_from is not None:
+        columns = {key: list(resume_from["columns"][key]) for key in TRACE_COLUMNS}
+    else:
+        columns = {key: [] for key in TRACE_COLUMNS}
+
+    # per-iteration timings and counts, only kept when profiling
+    times = None
+
+    def bookkeeping(row):
+        for key in columns:
+            columns[key].append(row[key])
+        if trace is not None:
+            trace.append(row)
+
+    def record(x, alpha, beta):
+        obj, J_x, J_alpha, J_beta = _timed(times, "diagnostics", _diagnostics,
+                                           state, x, alpha, beta)
+        row = {"x_norm": x@x, "alpha": alpha, "beta": beta,
+               "lambda": beta/alpha, "obj": obj,
+               "J_x": J_x, "J_alpha": J_alpha, "J_beta": J_beta}
+        _timed(times, "bookkeeping", bookkeeping, row)
+
+        return J_x + J_alpha + J_beta
+
+    if resume_from is None:
+        record(x, alpha, beta)
+
+    if profile:
+        times = {phase: [] for phase in PROFILE_PHASES}
+        counts = {key: [] for key in PROFILE_COUNTS}
+        counts_before = dict(state["counts"])
+
+    # iterate
+    # a converged run that is resumed returns its result without iterating
+    k = start - 1
+    for k in range(start, start if converged else niter):
+        print(k, end = "\r")
+        if hyper_first:
+            alpha, beta = _timed(times, "hyper_step", hyper_step, state, x, alpha, beta)
+            x = _timed(times, "x_step", x_step, state, x, alpha, beta)
+        else:
+            x = _timed(times, "x_step", x_step, state, x, alpha, beta)
+            alpha, beta = _timed(times, "hyper_step", hyper_step, state, x, alpha, beta)
+
+        grad = record(x, alpha, beta)
+
+        if profile:
+            for key in PROFILE_COUNTS:
+                counts[key].append(state["counts"][key] - counts_before[key])
+            counts_before = dict(state["counts"])
+
+        converged = grad < tol
+        if checkpoint is not None and (k + 1) % checkpoint_every == 0:
+            if trace is not None:
+                trace.flush()
+            _save_checkpoint(checkpoint, config, x, alpha, beta, k + 1,
+                             converged, columns, state)
+
+        if converged:
+            if print_res:
+                print('Successful')
+                print('Iterations:',k+1)
+                print('Gradient:',grad)
+            break
+        elif k == niter-1:
+            print('Maximum number of iterations reached.')
+            print('Gradient:',grad)
+
+    if trace is not None:
+        trace.flush()
+    if checkpoint is not None:
+        _save_checkpoint(checkpoint, config, x, alpha, beta, k + 1,
+                         converged, columns, state)
+    data = _to_frame({TRACE_COLUMNS[key]: values for key, values in columns.items()})
+
+    if profile:
+        summary = _profile_summary(times, counts)
+        if callable(profile):
+            profile(summary)
+        return x,alpha,beta,columns["obj"],data,summary
+
+    return x,alpha,beta,columns["obj"],data
+
+
+
+
+
+
+
+
+def Algorithm1(A,L,y_delta,hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6], niter=10000,tol=1e-5, print_res=False, trace=None, state=None, profile=False, init=None, checkpoint=None, checkpoint_every=100):
+
+    """
+    Implements method 1: closed form x-step and closed form hyperparameter
+    step.
+
+    Parameters
+    ----------
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    L : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    y_delta : an array (y_0,....,y_n).
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
+    niter : integer, optional
+        DESCRIPTION. The default is 10000.
+
+    tol : integer, optional
+        DESCRIPTION. The default is 1e-5.
+
+    print_res : Boolean, optional
+        DESCRIPTION. The default FALSE.
+
+    trace : a trace sink, optional
+        DESCRIPTION. See alternating_minimization. The default is None.
+
+    state : dict, optional
+        DESCRIPTION. See alternating_minimization, e.g. the output of
+        precompute or bayes_shared.attach_operators. The default is None.
+
+    profile : Boolean or function, optional
+        DESCRIPTION. See alternating_minimization. If set, a profile summary
+        is returned after data. The default is False.
+
+    init : tuple (x, alpha, beta), optional
+        DESCRIPTION. Initial guess, see alternating_minimization. The
+        default is None.
+
+    checkpoint : string, optional
+        DESCRIPTION. Path the run state is saved to every checkpoint_every
+        iterations, see alternating_minimization and resume. The default is
+        None.
+
+    checkpoint_every : integer, optional
+        DESCRIPTION. The default is 100.
+
+    Returns
+    -------
+    x : an array.
+        DESCRIPTION. An estimate for x_bar.
+
+    alpha : a real number > 0.
+
+    beta : a real number > 0.
+
+    obj_list : a list.
+
+    data : a pandas data frame.
+
+    """
+
+    return alternating_minimization(A, L, y_delta, solve_x_step,
+                                    closed_form_hyper_step, hyper_priors,
+                                    niter, tol, print_res, trace=trace,
+                                    state=state, profile=profile, init=init,
+                                    checkpoint=checkpoint,
+                                    checkpoint_every=checkpoint_every)
+
+
+
+
+
+def Algorithm2(A,L,y_delta, mu_a = 1e-3,mu_b=1e-3, niter=10000,tol=1e-5,print_res=False, trace=None, hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6], state=None, profile=False, init=None, checkpoint=None, checkpoint_every=100):
+
+    """
+    Implements method 2: closed form x-step and a gradient step in the
+    hyperparameters.
+
+    Parameters
+    ----------
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    L : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    y_delta : an array (y_0,....,y_n).
+
+    mu_a : real number, optional
+        DESCRIPTION. Step size for alpha. The default is 1e-3.
+
+    mu_b : real number, optional
+        DESCRIPTION. Step size for beta. The default is 1e-3.
+
+    niter : integer, optional
+        DESCRIPTION. The default is 10000.
+
+    tol : integer, optional
+        DESCRIPTION. The default is 1e-5.
+
+    print_res : Boolean, optional
+        DESCRIPTION. The default FALSE.
+
+    trace : a trace sink, optional
+        DESCRIPTION. See alternating_minimization. The default is None.
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
+    state : dict, optional
+        DESCRIPTION. See alternating_minimization, e.g. the output of
+        precompute or bayes_shared.attach_operators. The default is None.
+
+    profile : Boolean or function, optional
+        DESCRIPTION. See alternating_minimization. If set, a profile summary
+        is returned after data. The default is False.
+
+    init : tuple (x, alpha, beta), optional
+        DESCRIPTION. Initial guess, see alternating_minimization. The
+        default is None.
+
+    checkpoint : string, optional
+        DESCRIPTION. Path the run state is saved to every checkpoint_every
+        iterations, see alternating_minimization and resume. The default is
+        None.
+
+    checkpoint_every : integer, optional
+        DESCRIPTION. The default is 100.
+
+    Returns
+    -------
+    x : an array.
+        DESCRIPTION. An estimate for x_bar.
+
+    alpha : a real number > 0.
+
+    beta : a real number > 0.
+
+    obj_list : a list.
+
+    data : a pandas data frame.
 
     """
-    n = len(y)
-    partial_x = (A.T@A+(beta/alpha)*L.T@L)@x-A.T@y
-    partial_alpha = (1/2*np.linalg.norm(A@x-y)**2)-((n/2+a_0-1)/alpha)+b_0
-    partial_beta = (1/2*np.linalg.norm(L@x)**2)-((n/2+a_1-1)/beta)+b_1
-                   
-    sum_of_norms = np.linalg.norm(partial_x)**2+np.linalg.norm(partial_alpha)**2+np.linalg.norm(partial_beta)**2
 
-    return sum_of_norms
+    hyper_step = partial(gradient_hyper_step, mu_a=mu_a, mu_b=mu_b)
 
+    return alternating_minimization(A, L, y_delta, solve_x_step, hyper_step,
+                                    hyper_priors, niter, tol, print_res,
+                                    trace=trace, state=state,
+                                    profile=profile, init=init,
+                                    checkpoint=checkpoint,
+                                    checkpoint_every=checkpoint_every)
 
 
 
 
 
 
+def Algorithm3(A, L, y_delta, mu=1e-3, niter=10000,tol=1e-5,print_res=False, trace=None, hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6], state=None, profile=False, init=None, checkpoint=None, checkpoint_every=100):
 
-def Algorithm1(A,L,y_delta,hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6], niter=10000,tol=1e-5, print_res=False):
-    
     """
-    Implements method 1. 
+    Implements method 3: closed form hyperparameter step followed by a
+    gradient step in x.
 
     Parameters
     ----------
-    A : a matrix.
-    
-    L : a matrix. 
-    
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    L : a matrix, a scipy.sparse matrix or a LinearOperator.
+
     y_delta : an array (y_0,....,y_n).
-    
-    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
-        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
-    
+
+    mu : real number, optional
+        DESCRIPTION. Step size for x. The default is 1e-3.
+
     niter : integer, optional
-        DESCRIPTION. The default is 100000.
-    
+        DESCRIPTION. The default is 10000.
+
     tol : integer, optional
         DESCRIPTION. The default is 1e-5.
-        
+
     print_res : Boolean, optional
-        DESCRIPTION. The default FALSE. 
+        DESCRIPTION. The default FALSE.
+
+    trace : a trace sink, optional
+        DESCRIPTION. See alternating_minimization. The default is None.
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
+    state : dict, optional
+        DESCRIPTION. See alternating_minimization, e.g. the output of
+        precompute or bayes_shared.attach_operators. The default is None.
+
+    profile : Boolean or function, optional
+        DESCRIPTION. See alternating_minimization. If set, a profile summary
+        is returned after data. The default is False.
+
+    init : tuple (x, alpha, beta), optional
+        DESCRIPTION. Initial guess, see alternating_minimization. The
+        default is None.
+
+    checkpoint : string, optional
+        DESCRIPTION. Path the run state is saved to every checkpoint_every
+        iterations, see alternating_minimization and resume. The default is
+        None.
+
+    checkpoint_every : integer, optional
+        DESCRIPTION. The default is 100.
 
     Returns
     -------
-    x : an array. 
+    x : an array.
         DESCRIPTION. An estimate for x_bar.
-    
+
     alpha : a real number > 0.
-    
+
     beta : a real number > 0.
-    
-    data : a pandas data frame.        
+
+    obj_list : a list.
+
+    data : a pandas data frame.
 
     """
-    # parameters for algorithm 1
- 
-    n = len(y_delta)
-    # hyperparameters
-    #a_0 = 1 + 1e-6
-    #b_0 = 1e-6
-    #a_1 = 1 + 1e-6
-    #b_1 = 1e-6
-    
-    a_0 = hyper_priors[0]
-    b_0 = hyper_priors[1]
-    a_1 = hyper_priors[2]
-    b_1 = hyper_priors[3]
 
-    # initial guess
-    alpha =10
-    beta = 1
-    c = np.linalg.norm(A.T@y_delta)**2 / np.linalg.norm(A@A.T@y_delta)**2
-    x = c*A.T@y_delta
-    
-    #lists
-    alpha_list  = [alpha]
-    beta_list   = [beta] 
-    lmbd_list = [beta/alpha]
-    x_norm_list = [np.linalg.norm(x)**2]
-    x_list      =[x]
-    obj_list = [J(A,L,x,alpha,beta,y_delta,a_0,b_0,a_1,b_1)]
-    J_x = [np.linalg.norm((A.T@A+(beta/alpha)*L.T@L)@y_delta-A.T@x)**2]
-    J_alpha = [np.linalg.norm((1/2*np.linalg.norm(A@x-y_delta)**2)-((n/2+a_0-1)/alpha)+b_0)**2]
-    J_beta = [np.linalg.norm((1/2*np.linalg.norm(L@x)**2)-((n/2+a_1-1)/beta)+b_1)]
+    x_step = partial(gradient_x_step, mu=mu)
 
-    # iterate
-    
- 
-    for k in range(niter):
-        print(k, end = "\r")
-        x     = np.linalg.solve(A.T@A + (beta/alpha)*(L.T@L), A.T@y_delta)
-        alpha = ((n/2)+a_0-1) / (((1/2)*(np.linalg.norm(y_delta-A@x)**2)  + b_0)) 
-        beta  = ((n/2)+a_1-1) / (((1/2)*(np.linalg.norm(L@x)**2) + b_1))
-        obj = J(A,L,x,alpha,beta,y_delta,a_0,b_0,a_1,b_1)
-        
-        
-        partial_x = (A.T@A+(beta/alpha)*L.T@L)@x-A.T@y_delta
-        partial_alpha = (1/2*np.linalg.norm(A@x-y_delta)**2)-((n/2+a_0-1)/alpha)+b_0
-        partial_beta = (1/2*np.linalg.norm(L@x)**2)-((n/2+a_1-1)/beta)+b_1
-        
-        
-        #save all itterates
-        J_x.append(np.linalg.norm(partial_x)**2)
-        J_alpha.append(np.linalg.norm(partial_alpha)**2)
-        J_beta.append(np.linalg.norm(partial_beta)**2)
-
-      
-        x_norm_list.append(np.linalg.norm(x)**2)
-        x_list.append(x)
-        alpha_list.append(alpha)
-        beta_list.append(beta)
-        lmbd_list.append(beta/alpha)
-        obj_list.append(obj)
-        
-        grad = compute_gradient(A,L,beta,alpha,x,y_delta,a_0,a_1,b_0,b_1) 
+    return alternating_minimization(A, L, y_delta, x_step,
+                                    closed_form_hyper_step, hyper_priors,
+                                    niter, tol, print_res, hyper_first=True,
+                                    trace=trace, state=state,
+                                    profile=profile, init=init,
+                                    checkpoint=checkpoint,
+                                    checkpoint_every=checkpoint_every)
 
-        if grad < tol:
-            if print_res:
-                print('Successful')
-                print('Iterations:',k+1)
-                print('Gradient:',grad)
-            break 
-        elif k == niter-1:
-            print('Maximum number of iterations reached.')
-            print('Gradient:',grad)
-       
-           
 
 
-    data_dict = {"x_norm": x_norm_list, "alpha": alpha_list, "beta": beta_list, 
-                 "lambda": lmbd_list, "obj": obj_list, 
-                 '$||\nabla_x J||$':J_x,'$||\nabla_{a} J||$': J_alpha, 
-                 '$||\nabla_{B} J||$':J_beta }
-    data = pd.DataFrame.from_dict(data_dict)
 
-    return x,alpha,beta,obj_list,data
- 
-    
 
 
+def Algorithm4(A,L, y_delta,niter=10000,tol=1e-5,print_res=False, trace=None, hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6], state=None, profile=False, init=None, checkpoint=None, checkpoint_every=100):
 
-def Algorithm2(A,L,y_delta, mu_a = 1e-3,mu_b=1e-3, niter=10000,tol=1e-5,print_res=False):
-    
     """
-    Implements method 2. 
-    
+    Implements a modified method 1, where instead of using closed form soltuion
+    for x, we use the conjugate gradient method. Prints the number of CG
+    solves that did not converge.
+
     Parameters
     ----------
-    A : a matrix.
-    
-    L : a matrix. 
-    
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    L : a matrix, a scipy.sparse matrix or a LinearOperator.
+
     y_delta : an array (y_0,....,y_n).
-    
-    mu : integer, optional
-        DESCRIPTION. The default is 1e-3.
-    
+
     niter : integer, optional
-        DESCRIPTION. The default is 100000.
-    
+        DESCRIPTION. The default is 10000.
+
     tol : integer, optional
         DESCRIPTION. The default is 1e-5.
-        
+
     print_res : Boolean, optional
-        DESCRIPTION. The default FALSE. 
+        DESCRIPTION. The default FALSE.
+
+    trace : a trace sink, optional
+        DESCRIPTION. See alternating_minimization. The default is None.
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
+    state : dict, optional
+        DESCRIPTION. See alternating_minimization, e.g. the output of
+        precompute or bayes_shared.attach_operators. The default is None.
+
+    profile : Boolean or function, optional
+        DESCRIPTION. See alternating_minimization. If set, a profile summary
+        is returned after data. The default is False.
+
+    init : tuple (x, alpha, beta), optional
+        DESCRIPTION. Initial guess, see alternating_minimization. The
+        default is None.
+
+    checkpoint : string, optional
+        DESCRIPTION. Path the run state is saved to every checkpoint_every
+        iterations, see alternating_minimization and resume. The default is
+        None.
+
+    checkpoint_every : integer, optional
+        DESCRIPTION. The default is 100.
 
     Returns
     -------
-    x : an array. 
+    x : an array.
         DESCRIPTION. An estimate for x_bar.
-    
+
     alpha : a real number > 0.
-    
+
     beta : a real number > 0.
-    
-    data : a pandas data frame.       
-  
-    """
-    # parameters for algorithm 2
 
-    #mu=1e-3
-    
-    n = len(y_delta)
+    obj_list : a list.
 
-    # hyperparameters
-    a_0 = 1 + 1e-6
-    b_0 = 1e-6
-    a_1 = 1+ 1e-6
-    b_1 = 1e-6
-    
-    # initial guess
-    alpha =10
-    beta = 1
-    c = np.linalg.norm(A.T@y_delta)**2 / np.linalg.norm(A@A.T@y_delta)**2
-    x = c*A.T@y_delta
-   
-    
-    #lists
-    alpha_list  = [alpha]
-    beta_list   = [beta] 
-    lmbd_list = [beta/alpha]
-    x_norm_list = [np.linalg.norm(x)**2]
-    x_list      =[x]
-    obj_list = [J(A,L,x,alpha,beta,y_delta,a_0,b_0,a_1,b_1)]
-    J_x = [np.linalg.norm((A.T@A+(beta/alpha)*L.T@L)@y_delta-A.T@x)**2]
-    J_alpha = [np.linalg.norm((1/2*np.linalg.norm(A@x-y_delta)**2)-((n/2+a_0-1)/alpha)+b_0)**2]
-    J_beta = [np.linalg.norm((1/2*np.linalg.norm(L@x)**2)-((n/2+a_1-1)/beta)+b_1)]
- 
-    
+    data : a pandas data frame.
 
-    # iterate
-    obj = np.zeros(niter+1)
-    for k in range(niter):
-        print(k, end = "\r")
-        x      = np.linalg.solve(A.T@A + (beta/alpha)*(L.T@L), A.T@y_delta)
-        #mu = 1/np.linalg.norm((A.T@A) + (beta/alpha)*(L.T@L),ord=2)**2
-        alpha -= mu_a * ((1/2)*np.linalg.norm(y_delta-A@x)**2 + b_0 - ((n/2+a_0-1)/alpha))
-        beta  -= mu_b * ((1/2)*np.linalg.norm(L@x)**2 + b_1 - ((n/2+ a_1 - 1)/beta))
-        obj = J(A,L,x,alpha,beta,y_delta,a_0,b_0,a_1,b_1)
-        
-        partial_x = (A.T@A+(beta/alpha)*L.T@L)@x-A.T@y_delta
-        partial_alpha = (1/2*np.linalg.norm(A@x-y_delta)**2)-((n/2+a_0-1)/alpha)+b_0
-        partial_beta = (1/2*np.linalg.norm(L@x)**2)-((n/2+a_1-1)/beta)+b_1
-        
-        
-        #save all itterates
-        J_x.append(np.linalg.norm(partial_x)**2)
-        J_alpha.append(np.linalg.norm(partial_alpha)**2)
-        J_beta.append(np.linalg.norm(partial_beta)**2)
-
-      
-        x_norm_list.append(np.linalg.norm(x)**2)
-        x_list.append(x)
-        alpha_list.append(alpha)
-        beta_list.append(beta)
-        lmbd_list.append(beta/alpha)
-        obj_list.append(obj)
-        
-        grad = compute_gradient(A,L,beta,alpha,x,y_delta,a_0,a_1,b_0,b_1)
+    """
 
-        if grad < tol:
-            if print_res:
-                print('Successful')
-                print('Iterations:',k+1)
-                print('Gradient:',grad)
-            break
-        elif k == niter-1:
-            print('Maximum number of iterations reached.')
-            print('Gradient:',grad)
+    if state is None:
+        state = {}
+    result = alternating_minimization(A, L, y_delta, cg_x_step,
+                                      closed_form_hyper_step, hyper_priors,
+                                      niter, tol, print_res, trace=trace,
+                                      state=state, profile=profile, init=init,
+                                      checkpoint=checkpoint,
+                                      checkpoint_every=checkpoint_every)
+    print(state["cg_failures"])
 
+    return result
 
-        
-    data_dict = {"x_norm": x_norm_list, "alpha": alpha_list, "beta": beta_list, 
-                  "lambda": lmbd_list,"obj": obj_list, 
-                 '$||\nabla_x J||$':J_x,'$||\nabla_{a} J||$': J_alpha, '$||\nabla_{B} J||$':J_beta }
-    data = pd.DataFrame.from_dict(data_dict)
 
-    return x,alpha,beta,obj_list,data
- 
-    
 
 
 
+def AlgorithmTV(A, D, y_delta, eps=1e-3, hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6], niter=10000, tol=1e-5, print_res=False, trace=None, state=None, profile=False, init=None, checkpoint=None, checkpoint_every=100):
 
-def Algorithm3(A, L, y_delta, mu=1e-3, niter=10000,tol=1e-5,print_res=False):
-    
     """
-    Implements method 3. 
+    Implements method 1 with an edge preserving total variation penalty
+    beta*sum_i sqrt((Dx)_i^2 + eps^2) instead of (beta/2)||Lx||^2. The x-step
+    is one lagged diffusivity (IRLS) step, alternated with the closed form
+    alpha and beta updates of method 1.
 
     Parameters
     ----------
-    A : a matrix.
-    
-    L : a matrix. 
-    
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
+
+    D : a matrix, a scipy.sparse matrix or a LinearOperator.
+        DESCRIPTION. First order difference matrix, getD(t). Use sparse A
+        and D (getA_sparse, getD(t, sparse=True)) for banded solves.
+
     y_delta : an array (y_0,....,y_n).
-    
-    mu : integer, optional
-        DESCRIPTION. The default is 1e-5.
-    
+
+    eps : a real number > 0, optional
+        DESCRIPTION. Smoothing of the absolute value. The default is 1e-3.
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
     niter : integer, optional
-        DESCRIPTION. The default is 100000.
-    
+        DESCRIPTION. The default is 10000.
+
     tol : integer, optional
-        DESCRIPTION. The default is 1e-8.
-        
+        DESCRIPTION. The default is 1e-5.
+
     print_res : Boolean, optional
-        DESCRIPTION. The default FALSE. 
+        DESCRIPTION. The default FALSE.
+
+    trace : a trace sink, optional
+        DESCRIPTION. See alternating_minimization. The default is None.
+
+    state : dict, optional
+        DESCRIPTION. See alternating_minimization. The default is None.
+
+    profile : Boolean or function, optional
+        DESCRIPTION. See alternating_minimization. If set, a profile summary
+        is returned after data. The default is False.
+
+    init : tuple (x, alpha, beta), optional
+        DESCRIPTION. Initial guess, see alternating_minimization. The
+        default is None.
+
+    checkpoint : string, optional
+        DESCRIPTION. Path the run state is saved to every checkpoint_every
+        iterations, see alternating_minimization and resume. The default is
+        None.
+
+    checkpoint_every : integer, optional
+        DESCRIPTION. The default is 100.
 
     Returns
     -------
-    x : an array. 
+    x : an array.
         DESCRIPTION. An estimate for x_bar.
-    
+
     alpha : a real number > 0.
-    
+
     beta : a real number > 0.
-    
-    data : a pandas data frame.  
-    
-    """
-    # parameters for algorithm 3
-  
-    n = len(y_delta)
 
-    # hyperparameters
-    a_0 = 1 + 1e-6
-    b_0 = 1e-6
-    a_1 = 1+ 1e-6
-    b_1 = 1e-6
-    
-    # initial guess
-    alpha =10
-    beta = 1
-    c = np.linalg.norm(A.T@y_delta)**2 / np.linalg.norm(A@A.T@y_delta)**2
-    x = c*A.T@y_delta
-    
-   
-    #lists
-    alpha_list  = [alpha]
-    beta_list   = [beta] 
-    lmbd_list = [beta/alpha]
-    
-    x_norm_list = [np.linalg.norm(x)**2]
-    x_list      =[x]
-    
-    obj_list = [J(A,L,x,alpha,beta,y_delta,a_0,b_0,a_1,b_1)]
-    
-    J_x = [np.linalg.norm((A.T@A+(beta/alpha)*L.T@L)@y_delta-A.T@x)**2]
-    J_alpha = [np.linalg.norm((1/2*np.linalg.norm(A@x-y_delta)**2)-((n/2+a_0-1)/alpha)+b_0)**2]
-    J_beta = [np.linalg.norm((1/2*np.linalg.norm(L@x)**2)-((n/2+a_1-1)/beta)+b_1)]
- 
-    
-     # iterate
-    obj = np.zeros(niter)
-    for k in range(niter):
-        print(k, end = "\r")
-        alpha = ((n/2)+a_0-1) / (((1/2)*(np.linalg.norm(y_delta-A@x)**2)  + b_0)) 
-        beta  = ((n/2)+a_1-1) / (((1/2)*(np.linalg.norm(L@x)**2) + b_1))
-        #mu = 1/np.linalg.norm((A.T@A) + (beta/alpha)*(L.T@L),ord=2)**2
-        #g  = alpha*(A.T@(A@x - y_delta)) + beta*(L.T@(L@x))
-        g=(A.T@A+(beta/alpha)*L.T@L)@x-A.T@y_delta
-        x -= mu * g
-        obj = J(A,L,x,alpha,beta,y_delta,a_0,b_0,a_1,b_1)
-        partial_x = (A.T@A+(beta/alpha)*L.T@L)@x-A.T@y_delta
-        partial_alpha = (1/2*np.linalg.norm(A@x-y_delta)**2)-((n/2+a_0-1)/alpha)+b_0
-        partial_beta = (1/2*np.linalg.norm(L@x)**2)-((n/2+a_1-1)/beta)+b_1
-        
-     #save all itterates
-        J_x.append(np.linalg.norm(partial_x)**2)
-        J_alpha.append(np.linalg.norm(partial_alpha)**2)
-        J_beta.append(np.linalg.norm(partial_beta)**2)
-
-      
-        x_norm_list.append(np.linalg.norm(x)**2)
-        x_list.append(x)
-        alpha_list.append(alpha)
-        beta_list.append(beta)
-        lmbd_list.append(beta/alpha)
-        obj_list.append(obj)
-        
-        grad = compute_gradient(A,L,beta,alpha,x,y_delta,a_0,a_1,b_0,b_1)
+    obj_list : a list.
 
-        if grad < tol:
-            if print_res:
-                print('Successful')
-                print('Iterations:',k+1)
-                print('Gradient:',grad)
-            break 
-        elif k == niter-1:
-            print('Maximum number of iterations reached.')
-            print('Gradient:',grad)
+    data : a pandas data frame.
 
-            
+    """
 
-    data_dict = {"x_norm": x_norm_list, "alpha": alpha_list, "beta": beta_list, 
-                 "lambda": lmbd_list, "obj": obj_list, 
-                 '$||\nabla_x J||$':J_x,'$||\nabla_{a} J||$': J_alpha, 
-                 '$||\nabla_{B} J||$':J_beta }
-    data = pd.DataFrame.from_dict(data_dict)
+    return alternating_minimization(A, D, y_delta, irls_x_step,
+                                    closed_form_hyper_step, hyper_priors,
+                                    niter, tol, print_res, trace=trace,
+                                    state=state, profile=profile, init=init,
+                                    checkpoint=checkpoint,
+                                    checkpoint_every=checkpoint_every,
+                                    penalty=partial(tv_penalty, eps=eps),
+                                    beta_shape=D.shape[0])
 
-    return x,alpha,beta,obj_list,data
 
 
 
 
+def resume(path, A, L, y_delta, niter=None, print_res=False, trace=None, state=None, profile=False, checkpoint_every=100):
 
+    """
+    Continues a run from a checkpoint written by Algorithm1-4, AlgorithmTV
+    or alternating_minimization. The steps, penalty and hyper_priors of the
+    run are read from the checkpoint, and since every step only depends on
+    x, alpha and beta (CG is warm started from x), the iterates are the same
+    as those of an uninterrupted run. Further checkpoints are written to the
+    same path. If the run had converged, its result is returned without
+    iterating.
 
-def Algorithm4(A,L, y_delta,niter=10000,tol=1e-5,print_res=False):
-    
-    """  
-    Implements a modified method 1, where instead of using closed form soltuion
-    for x, we use a graident method.
-    
     Parameters
     ----------
+    path : string.
+        DESCRIPTION. The checkpoint.
+
     A : a matrix.
-    
-    L : a matrix. 
-    
+        DESCRIPTION. The operators and data of the interrupted run.
+
+    L : a matrix.
+
     y_delta : an array (y_0,....,y_n).
-    
+
     niter : integer, optional
-        DESCRIPTION. The default is 100000.
-    
-    tol : integer, optional
-        DESCRIPTION. The default is 1e-5.
-        
+        DESCRIPTION. Maximum number of iterations, counted from the start of
+        the interrupted run. The default is None, which means the niter of
+        that run.
+
     print_res : Boolean, optional
-        DESCRIPTION. The default FALSE. 
+        DESCRIPTION. The default FALSE.
 
-    Returns
-    -------
-    x : an array. 
-        DESCRIPTION. An estimate for x_bar.
-    
-    alpha : a real number > 0.
-    
-    beta : a real number > 0.
-    
-    data : a pandas data frame.  
-    
-    """
+    trace : a trace sink, optional
+        DESCRIPTION. Receives the records of the iterations after the
+        checkpoint. The trace is flushed at every checkpoint, so records of
+        the interrupted run after its last checkpoint may already be in a
+        trace directory; use a new one to avoid duplicates. The default is
+        None.
 
-    # parameters for algorithm 4
- 
-    n = len(y_delta)
-    # hyperparameters
-    a_0 = 1 + 1e-6
-    b_0 = 1e-6
-    a_1 = 1 + 1e-6
-    b_1 = 1e-6
+    state : dict, optional
+        DESCRIPTION. See alternating_minimization. The default is None.
 
-    # initial guess
-    alpha =10
-    beta = 1
-    c = np.linalg.norm(A.T@y_delta)**2 / np.linalg.norm(A@A.T@y_delta)**2
-    x = c*A.T@y_delta
-    
-    #lists
-    alpha_list  = [alpha]
-    beta_list   = [beta] 
-    lmbd_list =[beta/alpha]
-    x_norm_list = [np.linalg.norm(x)**2]
-    x_list      =[x]
-    obj_list = [J(A,L,x,alpha,beta,y_delta,a_0,b_0,a_1,b_1)]
-    J_x = [np.linalg.norm((A.T@A+(beta/alpha)*L.T@L)@y_delta-A.T@x)**2]
-    J_alpha = [np.linalg.norm((1/2*np.linalg.norm(A@x-y_delta)**2)-((n/2-a_0-1)/alpha)+b_0)**2]
-    J_beta = [np.linalg.norm((1/2*np.linalg.norm(L@x)**2)-((n/2-a_1-1)/beta)+b_1)]
+    profile : Boolean or function, optional
+        DESCRIPTION. Profiles the iterations after the checkpoint, see
+        alternating_minimization. The default is False.
 
-    # iterate
-    
-    div =0
-    
-    for k in range(niter):
-        print(k, end = "\r")
-        x_array     = cg(A.T@A + (beta/alpha)*(L.T@L), A.T@y_delta)
-        x = x_array[0]
-        if x_array[1]!= 0:
-            div = div +1 
-        alpha = ((n/2)+a_0-1) / (((1/2)*(np.linalg.norm(y_delta-A@x)**2)  + b_0)) 
-        beta  = ((n/2)+a_1-1) / (((1/2)*(np.linalg.norm(L@x)**2) + b_1))
-        obj = J(A,L,x,alpha,beta,y_delta,a_0,b_0,a_1,b_1)
-        
-        
-        partial_x = (A.T@A+(beta/alpha)*L.T@L)@x-A.T@y_delta
-        partial_alpha = (1/2*np.linalg.norm(A@x-y_delta)**2)-((n/2+a_0-1)/alpha)+b_0
-        partial_beta = (1/2*np.linalg.norm(L@x)**2)-((n/2+a_1-1)/beta)+b_1
-        
-        
-        #save all itterates
-        J_x.append(np.linalg.norm(partial_x)**2)
-        J_alpha.append(np.linalg.norm(partial_alpha)**2)
-        J_beta.append(np.linalg.norm(partial_beta)**2)
-
-      
-        x_norm_list.append(np.linalg.norm(x)**2)
-        x_list.append(x)
-        alpha_list.append(alpha)
-        beta_list.append(beta)
-        lmbd_list.append(beta/alpha)
-        obj_list.append(obj)
-        
-        grad = compute_gradient(A,L,beta,alpha,x,y_delta,a_0,a_1,b_0,b_1)
+    checkpoint_every : integer, optional
+        DESCRIPTION. The default is 100.
 
-        if grad < tol:
-            if print_res:
-                print('Successful')
-                print('Iterations:',k+1)
-                print('Gradient:',grad)
-            break 
-        elif k == niter-1:
-            print('Maximum number of iterations reached.')
-            print('Gradient:',grad)
+    Returns
+    -------
+    The output of the interrupted run, with obj_list and data covering all
+    iterations.
 
-    print(div)        
-        
-    data_dict = {"x_norm": x_norm_list, "alpha": alpha_list, "beta": beta_list, 
-                 "lambda": lmbd_list, "obj": obj_list, '$||\nabla_x J||$':J_x,
-                 '$||\nabla_{a} J||$': J_alpha, '$||\nabla_{B} J||$':J_beta }
-    data = pd.DataFrame.from_dict(data_dict)
+    """
 
-    return x,alpha,beta,obj_list,data
+    checkpoint = load_checkpoint(path)
+    config = checkpoint["config"]
+
+    return alternating_minimization(A, L, y_delta, _restore(config["x_step"]),
+                                    _restore(config["hyper_step"]),
+                                    config["hyper_priors"],
+                                    config["niter"] if niter is None else niter,
+                                    config["tol"], print_res,
+                                    hyper_first=config["hyper_first"],
+                                    trace=trace, state=state, profile=profile,
+                                    penalty=_restore(config["penalty"]),
+                                    beta_shape=config["beta_shape"],
+                                    checkpoint=path,
+                                    checkpoint_every=checkpoint_every,
+                                    resume_from=checkpoint)
 
 
 
@@ -702,6 +1686,8 @@ def plot_results(obj, t,A, x_bar, x_hat,alpha_hat, beta_hat, y_delta,name, log=F
     None.
 
     """
+    import matplotlib.pyplot as plt
+    
     
     err = np.linalg.norm(x_bar-x_hat)**2
     fig,ax = plt.subplots(1,3)
@@ -747,6 +1733,8 @@ def plot_estimates(df,name):
     None.
 
     """
+    import matplotlib.pyplot as plt
+    
     fig,ax = plt.subplots(2,2)
     ax[0,0].plot(np.arange(len(df['alpha'].to_numpy())),df['alpha'].to_numpy())
     ax[0,0].set_title('alpha')
@@ -789,9 +1777,9 @@ def getObj(A,L,y_delta,alpha, beta):
 
     Parameters
     ----------
-    A : a matrix.
+    A : a matrix, a scipy.sparse matrix or a LinearOperator.
     
-    L : a matrix. 
+    L : a matrix, a scipy.sparse matrix or a LinearOperator. 
     
     y_delta : an array (y_0,....,y_n).
     
@@ -813,7 +1801,10 @@ def getObj(A,L,y_delta,alpha, beta):
     b_1 = 1e-6
 
     #x_hat(alpha, beta) = (A^*A + beta/alpha L^*L)^-1 A*y_delta
-    x_hat = np.linalg.solve(A.T@A + (beta/alpha)*L.T@L, A.T@y_delta)
+    A, L = _as_operator(A), _as_operator(L)
+    state = {"A": A, "L": L, "n": len(y_delta), "Aty": A.T@y_delta,
+             "cg_failures": 0, "counts": {key: 0 for key in PROFILE_COUNTS}}
+    x_hat = solve_x_step(state, np.zeros(len(y_delta)), alpha, beta)
     
     
     obj_func = J(A,L,x_hat,alpha,beta,y_delta,a_0,a_1,b_0,b_1)
@@ -916,6 +1907,8 @@ def getObj(A,L,y_delta,alpha, beta):
 
 
 def plot_contour(A,L, y_delta, df, name ,ns=50, ranges=[0.5,150,0.01,10],save=True ):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
    
 
     alpha_hat = df['alpha'].to_numpy()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio reconstruction service for many y_delta on the same A and L.
+
+Requests are queued and those that arrive within a short window are solved
+together by Algorithm1_batch, a vectorized Algorithm1 on the cached
+decomposition of bayes_param_choice.spectral_decomposition. The service can
+be used in-process,
+
+    service = ReconstructionService(A, L)
+    await service.start()
+    x, alpha, beta = await service.reconstruct(y_delta)
+
+or over a local socket with serve, which reads one JSON object
+{"y": [...]} per line and answers {"x": [...], "alpha": ..., "beta": ...}.
+"""
+
+
+import asyncio
+import json
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+
+from bayes_param_choice import spectral_decomposition
+
+
+
+
+
+def Algorithm1_batch(decomposition, Y, hyper_priors = [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6],
+                     niter=10000, tol=1e-5):
+
+    """
+    Implements method 1 for every column of Y at once. In the basis of the
+    SVD A L^-1 = U diag(s) W^T the x-step is diagonal, so an iteration costs
+    O(n) per column for the alpha and beta updates plus one matrix product
+    for the stopping criterion, instead of a dense solve per column. The
+    iterates of alpha and beta are those of Algorithm1, and each column stops
+    when its gradient (see compute_gradient) is below tol.
+
+    Parameters
+    ----------
+    decomposition : dict.
+        DESCRIPTION. Output of bayes_param_choice.spectral_decomposition.
+        The products "LtW" = L^T W and "LinvW" = L^-1 W are added to it on
+        first use.
+
+    Y : a matrix n by k.
+        DESCRIPTION. One y_delta per column.
+
+    hyper_priors : array, optional.length 4 in order of a0, b0, a1,b1
+        DESCRIPTION. The defualt is [1 + 1e-6, 1e-6, 1 + 1e-6, 1e-6].
+
+    niter : integer, optional
+        DESCRIPTION. The default is 10000.
+
+    tol : integer, optional
+        DESCRIPTION. The default is 1e-5.
+
+    Returns
+    -------
+    X : a matrix n by k.
+        DESCRIPTION. The estimates of x_bar.
+
+    alpha : an array of length k.
+
+    beta : an array of length k.
+
+    iterations : an array of length k.
+
+    """
+
+    U, s, W, L = (decomposition[key] for key in ("U", "s", "W", "L"))
+    if "LtW" not in decomposition:
+        decomposition["LtW"] = L.T@W
+        decomposition["LinvW"] = np.linalg.solve(L, W)
+    LtW = decomposition["LtW"]
+
+    a_0, b_0, a_1, b_1 = hyper_priors
+    # n is the number of data points, as in Algorithm1, which differs from
+    # len(s) for a non-square A
+    Y = np.asarray(Y, dtype=float).reshape(U.shape[0], -1)
+    n, k = Y.shape
+    UtY = U.T@Y
+    outside = np.maximum(np.sum(Y**2, axis=0) - np.sum(UtY**2, axis=0), 0)
+    s = s[:, None]
+
+    # initial guess as in Algorithm1; only alpha and beta enter the iteration
+    alpha = np.full(k, 10.0)
+    beta = np.ones(k)
+    C = np.zeros((len(s), k))
+    iterations = np.zeros(k, dtype=int)
+    active = np.ones(k, dtype=bool)
+
+    for it in range(niter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        uty = UtY[:, idx]
+
+        # x-step: coefficients c of L x = W c for lambda = beta/alpha
+        f = s**2/(s**2 + beta[idx]/alpha[idx])
+        c = f/s*uty
+        res = np.sum(((1 - f)*uty)**2, axis=0) + outside[idx]
+        reg = np.sum(c**2, axis=0)
+
+        # closed form alpha and beta
+        a = ((n/2)+a_0-1) / ((1/2)*res + b_0)
+        b = ((n/2)+a_1-1) / ((1/2)*reg + b_1)
+
+        # gradient at (x, alpha, beta): partial_x = L^T W (s (s c - U^T y) + lambda c)
+        partial_x = LtW@(s*(s*c - uty) + (b/a)*c)
+        partial_alpha = (1/2*res)-((n/2+a_0-1)/a)+b_0
+        partial_beta = (1/2*reg)-((n/2+a_1-1)/b)+b_1
+        grad = np.sum(partial_x**2, axis=0) + partial_alpha**2 + partial_beta**2
+
+        C[:, idx] = c
+        alpha[idx] = a
+        beta[idx] = b
+        iterations[idx] = it + 1
+        active[idx[grad < tol]] = False
+
+    X = decomposition["LinvW"]@C
+
+    return X, alpha, beta, iterations
+
+
+
+
+
+class ReconstructionService:
+
+    """
+    Queues reconstruction requests for fixed A and L and solves them in
+    micro-batches with Algorithm1_batch.
+
+    Parameters
+    ----------
+    A : a matrix.
+
+    L : an invertible matrix.
+
+    max_batch : integer, optional
+        DESCRIPTION. Largest number of requests solved together. The default
+        is 32.
+
+    max_latency : a real number > 0, optional
+        DESCRIPTION. Seconds a batch waits for more requests after its first
+        one arrived. The default is 0.005.
+
+    max_queue : integer, optional
+        DESCRIPTION. Number of queued requests beyond which reconstruct waits
+        for room in the queue (backpressure). The default is 1024.
+
+    decomposition : dict, optional
+        DESCRIPTION. Output of spectral_decomposition(A, L), e.g. shared with
+        a parameter choice run. The default is None.
+
+    **solver_args :
+        DESCRIPTION. hyper_priors, niter and tol of Algorithm1_batch.
+
+    """
+
+    def __init__(self, A, L, max_batch=32, max_latency=0.005, max_queue=1024,
+                 decomposition=None, **solver_args):
+        if decomposition is None:
+            decomposition = spectral_decomposition(A, L)
+        self.decomposition = decomposition
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_queue = max_queue
+        self.solver_args = solver_args
+
+        self._queue = None
+        self._worker = None
+        self._pending = set()
+        self._started = None
+        self._latencies = deque(maxlen=1000)
+        self._batch_sizes = deque(maxlen=1000)
+        self._served = 0
+
+
+    async def start(self):
+
+        """
+        Starts the batching loop on the running event loop.
+        """
+
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._started = perf_counter()
+        self._worker = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+
+        """
+        Stops the batching loop. Requests that were not solved yet are
+        cancelled, whether they are queued, in the current batch or still
+        waiting for room in the queue.
+        """
+
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        self._queue = None
+        for future in list(self._pending):
+            future.cancel()
+        self._pending.clear()
+
+
+    async def reconstruct(self, y_delta):
+
+        """
+        Queues y_delta and waits for its reconstruction.
+
+        Returns
+        -------
+        x : an array.
+
+        alpha : a real number > 0.
+
+        beta : a real number > 0.
+
+        """
+
+        if self._queue is None:
+            raise RuntimeError("The service is not running, call start first.")
+        y_delta = np.asarray(y_delta, dtype=float)
+        n = self.decomposition["U"].shape[0]
+        if y_delta.shape != (n,):
+            raise ValueError("y_delta has shape %s, expected (%d,)." % (y_delta.shape, n))
+
+        # the future is registered before waiting for room in the queue, and
+        # the wait ends when it is resolved, so that stop also cancels
+        # requests held up by backpressure
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        put = asyncio.ensure_future(self._queue.put((y_delta, future, perf_counter())))
+        try:
+            await asyncio.wait([put, future], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not put.done():
+                put.cancel()
+
+        return await future
+
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                Y = np.column_stack([y for y, _, _ in batch])
+                X, alpha, beta, _ = await loop.run_in_executor(
+                    None, lambda: Algorithm1_batch(self.decomposition, Y, **self.solver_args))
+            except Exception as error:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            done = perf_counter()
+            for i, (_, future, queued) in enumerate(batch):
+                if not future.done():
+                    future.set_result((X[:, i], alpha[i], beta[i]))
+                self._latencies.append(done - queued)
+            self._batch_sizes.append(len(batch))
+            self._served += len(batch)
+
+
+    def metrics(self):
+
+        """
+        Returns the number of served requests and batches, the throughput in
+        requests per second since start, the mean batch size, the current
+        queue length and the latency quantiles in seconds of the last 1000
+        requests.
+        """
+
+        latencies = np.array(self._latencies) if self._latencies else np.zeros(1)
+        elapsed = perf_counter() - self._started if self._started else 0
+
+        return {"served": self._served,
+                "batches": len(self._batch_sizes),
+                "throughput": self._served/elapsed if elapsed else 0.0,
+                "mean_batch_size": float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0,
+                "queued": self._queue.qsize() if self._queue else 0,
+                "latency_p50": float(np.quantile(latencies, 0.5)),
+                "latency_p95": float(np.quantile(latencies, 0.95)),
+                "latency_max": float(np.max(latencies))}
+
+
+    async def serve(self, host='127.0.0.1', port=0):
+
+        """
+        Serves reconstructions over a local TCP socket, one JSON object per
+        line. A request {"y": [...]} is answered with
+        {"x": [...], "alpha": ..., "beta": ...}, and {"metrics": true} with
+        the output of metrics. An invalid request is answered with
+        {"error": ...} and the connection stays open. Starts the service if
+        needed.
+
+        Returns
+        -------
+        server : an asyncio.Server.
+            DESCRIPTION. server.sockets[0].getsockname() gives the port.
+
+        """
+
+        if self._worker is None:
+            await self.start()
+
+        async def handle(reader, writer):
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise TypeError("expected a JSON object")
+                    if request.get("metrics"):
+                        reply = self.metrics()
+                    else:
+                        x, alpha, beta = await self.reconstruct(request["y"])
+                        reply = {"x": x.tolist(), "alpha": float(alpha), "beta": float(beta)}
+                except (ValueError, KeyError, TypeError, RuntimeError) as error:
+                    reply = {"error": "%s: %s" % (type(error).__name__, error)}
+                writer.write((json.dumps(reply) + '\n').encode())
+                await writer.drain()
+            writer.close()
+
+        return await asyncio.start_server(handle, host, port)
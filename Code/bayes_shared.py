@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Zero-copy sharing of the operators between worker processes.
+
+share_operators copies A, L and any cached products (see
+bayes_reg.precompute) once into shared memory, or into memory-mapped .npy
+files, and returns a small picklable handle. Workers pass the handle to
+attach_operators and get read-only NumPy views of the same memory, which
+Algorithm1-4 accept like ordinary arrays:
+
+    ops = precompute(A, L)
+    handle, blocks = share_operators(A=A, L=L, **ops)
+    # in each worker
+    state = attach_operators(handle)
+    Algorithm1(state["A"], state["L"], y_delta, state=state)
+    # in a worker that is done with the views
+    del state; detach(handle)
+    # in the parent, once all workers are done
+    release(blocks)
+"""
+
+
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy.sparse import issparse, csr_matrix
+
+
+#shared memory blocks attached in this process, by name. They have to stay
+#open for as long as the views on them are used, and attaching the same
+#block again reuses its mapping.
+_attached = {}
+
+
+
+
+
+def _share_array(array, name, path, blocks):
+
+    """
+    Copies one array into a new shared memory block, or into path/name.npy
+    if path is given, and returns its spec for the handle.
+    """
+
+    array = np.ascontiguousarray(array)
+
+    if path is not None:
+        file = os.path.join(path, name + '.npy')
+        np.save(file, array)
+        return ("file", file)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    blocks.append(shm)
+
+    return ("shm", shm.name, array.shape, array.dtype.str)
+
+
+
+
+
+def _attach_array(spec):
+
+    """
+    Returns a read-only view of an array shared by _share_array.
+    """
+
+    if spec[0] == "file":
+        return np.load(spec[1], mmap_mode='r')
+
+    _, name, shape, dtype = spec
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    shm = _attached[name]
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    array.flags.writeable = False
+
+    return array
+
+
+
+
+
+def share_operators(path=None, **operators):
+
+    """
+    Places operators in shared memory, or in memory-mapped files, so that
+    worker processes can use them without receiving a pickled copy.
+
+    Parameters
+    ----------
+    path : string, optional
+        DESCRIPTION. Directory for memory-mapped .npy files. If None the
+        operators are placed in multiprocessing.shared_memory blocks. The
+        default is None.
+
+    **operators : arrays or scipy.sparse matrices.
+        DESCRIPTION. E.g. A=A, L=L and the output of bayes_reg.precompute.
+        Sparse matrices are shared in CSR format.
+
+    Returns
+    -------
+    handle : dict.
+        DESCRIPTION. Picklable description of the shared operators, to be
+        passed to attach_operators.
+
+    blocks : list.
+        DESCRIPTION. The shared memory blocks. The process that shares the
+        operators owns them and frees them with release.
+
+    """
+
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+
+    handle = {}
+    blocks = []
+    for key, M in operators.items():
+        if issparse(M):
+            M = csr_matrix(M)
+            handle[key] = ("csr", M.shape,
+                           [_share_array(part, key + '_' + part_name, path, blocks)
+                            for part_name, part in (("data", M.data),
+                                                    ("indices", M.indices),
+                                                    ("indptr", M.indptr))])
+        else:
+            handle[key] = ("dense", _share_array(M, key, path, blocks))
+
+    return handle, blocks
+
+
+
+
+
+def attach_operators(handle):
+
+    """
+    Attaches to operators shared by share_operators.
+
+    Parameters
+    ----------
+    handle : dict.
+        DESCRIPTION. Handle returned by share_operators.
+
+    Returns
+    -------
+    operators : dict.
+        DESCRIPTION. Read-only views of the shared operators under the names
+        they were shared with. It can be passed as state to Algorithm1-4.
+
+    """
+
+    operators = {}
+    for key, spec in handle.items():
+        if spec[0] == "csr":
+            data, indices, indptr = [_attach_array(part) for part in spec[2]]
+            operators[key] = csr_matrix((data, indices, indptr), shape=spec[1],
+                                        copy=False)
+        else:
+            operators[key] = _attach_array(spec[1])
+
+    return operators
+
+
+
+
+
+def detach(handle=None):
+
+    """
+    Closes the shared memory blocks of handle attached in this process, or
+    all of them if handle is None. The views returned by attach_operators
+    must not be used anymore, and all references to them must be dropped
+    first (closing a block with live views raises BufferError).
+    """
+
+    if handle is None:
+        names = list(_attached)
+    else:
+        names = [part[1] for spec in handle.values()
+                 for part in (spec[2] if spec[0] == "csr" else [spec[1]])
+                 if part[0] == "shm"]
+
+    for name in names:
+        shm = _attached.pop(name, None)
+        if shm is not None:
+            shm.close()
+
+
+
+
+
+def release(blocks):
+
+    """
+    Frees the shared memory blocks returned by share_operators. Call it in
+    the sharing process once all workers are done.
+    """
+
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming trace sink for the algorithms in bayes_reg.
+
+Long runs can write their iteration records to disk in chunks instead of
+only returning them at the end. Every chunk is a complete .npz file, so a
+trace can be read with load_trace while the run is still going and survives
+a crash up to the last flushed chunk.
+"""
+
+
+import os
+import glob
+
+import numpy as np
+
+from bayes_reg import TRACE_COLUMNS
+
+
+
+
+
+class TraceWriter:
+
+    """
+    Collects iteration records and appends them to a directory as numbered
+    .npz chunks with one array per key of bayes_reg.TRACE_COLUMNS.
+
+    Parameters
+    ----------
+    path : string.
+        DESCRIPTION. Directory the chunks are written to. Created if needed.
+        Chunks already in the directory are kept and new ones are numbered
+        after them.
+
+    chunk_size : integer, optional
+        DESCRIPTION. Number of records per chunk. The default is 1000.
+
+    """
+
+    def __init__(self, path, chunk_size=1000):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.n_chunks = len(_chunk_files(path))
+        self._rows = {key: [] for key in TRACE_COLUMNS}
+
+
+    def append(self, record):
+
+        """
+        Adds one iteration record, a dict keyed as bayes_reg.TRACE_COLUMNS,
+        and writes a chunk once chunk_size records are buffered.
+        """
+
+        for key in TRACE_COLUMNS:
+            self._rows[key].append(record[key])
+        if len(self._rows["obj"]) >= self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+
+        """
+        Writes the buffered records as a new chunk. The chunk is written to a
+        temporary file first and then renamed, so readers never see a
+        partially written chunk.
+        """
+
+        if not self._rows["obj"]:
+            return
+
+        name = os.path.join(self.path, 'chunk_{:06d}.npz'.format(self.n_chunks))
+        tmp = name + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **{key: np.asarray(rows, dtype=float)
+                           for key, rows in self._rows.items()})
+        os.replace(tmp, name)
+
+        self.n_chunks += 1
+        self._rows = {key: [] for key in TRACE_COLUMNS}
+
+
+    def close(self):
+        self.flush()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+
+
+def _chunk_files(path):
+    return sorted(glob.glob(os.path.join(path, 'chunk_*.npz')))
+
+
+
+
+
+def load_trace(path, frame=True):
+
+    """
+    Reads all complete chunks written by a TraceWriter.
+
+    Parameters
+    ----------
+    path : string.
+        DESCRIPTION. Directory of the trace.
+
+    frame : Boolean, optional
+        DESCRIPTION. If True the trace is returned as a pandas data frame with
+        the same columns as the data returned by Algorithm1-4, otherwise as
+        a dict of arrays keyed as bayes_reg.TRACE_COLUMNS. The default is True.
+
+    Returns
+    -------
+    data : a pandas data frame or a dict of arrays.
+
+    """
+
+    columns = {key: [] for key in TRACE_COLUMNS}
+    for name in _chunk_files(path):
+        with np.load(name) as chunk:
+            for key in TRACE_COLUMNS:
+                columns[key].append(chunk[key])
+    columns = {key: np.concatenate(arrays) if arrays else np.zeros(0)
+               for key, arrays in columns.items()}
+
+    if not frame:
+        return columns
+
+    import pandas as pd
+
+    return pd.DataFrame.from_dict({TRACE_COLUMNS[key]: array
+                                   for key, array in columns.items()})
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Import time of bayes_reg. pandas, matplotlib and seaborn are only imported
+by the functions that need them, so importing the module for a solver run
+should stay cheap. Run with python -m pytest from this directory.
+"""
+
+
+import os
+import re
+import subprocess
+import sys
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# cumulative import time budget of bayes_reg in seconds, numpy and scipy
+# included
+IMPORT_BUDGET = 2.0
+
+
+
+
+
+def _run(*args):
+    return subprocess.run([sys.executable, *args], cwd=HERE,
+                          capture_output=True, text=True, check=True)
+
+
+
+
+
+def test_no_plotting_or_pandas_on_import():
+    _run('-c', "import bayes_reg, sys; "
+               "assert 'pandas' not in sys.modules, 'pandas imported'; "
+               "assert 'matplotlib' not in sys.modules, 'matplotlib imported'; "
+               "assert 'seaborn' not in sys.modules, 'seaborn imported'")
+
+
+
+
+
+def test_import_time_budget():
+    stderr = _run('-X', 'importtime', '-c', 'import bayes_reg').stderr
+    match = re.search(r'^import time:\s*\d+ \|\s*(\d+) \| bayes_reg$', stderr, re.M)
+    assert match is not None
+    assert int(match.group(1))/1e6 < IMPORT_BUDGET
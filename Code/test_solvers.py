@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Consistency checks of the solvers: resuming from a checkpoint reproduces an
+uninterrupted run, Algorithm1_batch reproduces Algorithm1 and the spectral
+path of parameter_choice reproduces dense solves. Run with python -m pytest
+from this directory.
+"""
+
+
+import numpy as np
+import pytest
+
+from bayes_reg import getA, getL, Algorithm1, Algorithm3, Algorithm4, resume
+from bayes_service import Algorithm1_batch
+from bayes_param_choice import spectral_decomposition, parameter_choice
+
+
+
+
+
+def _problem(n=50, noise=1e-2, seed=0):
+    t = np.linspace(0, 1, n)
+    A = getA(t)
+    L = getL(t)
+    rng = np.random.default_rng(seed)
+    y_delta = A@np.sin(3*t) + noise*rng.standard_normal(n)
+
+    return A, L, y_delta
+
+
+
+
+
+@pytest.mark.parametrize("algorithm", [Algorithm3, Algorithm4])
+def test_resume_is_bit_for_bit(algorithm, tmp_path):
+    A, L, y_delta = _problem()
+    path = str(tmp_path/"run.npz")
+
+    x, alpha, beta, obj_list, data = algorithm(A, L, y_delta, niter=250, tol=0)
+    algorithm(A, L, y_delta, niter=100, tol=0, checkpoint=path, checkpoint_every=100)
+    x_r, alpha_r, beta_r, obj_list_r, data_r = resume(path, A, L, y_delta, niter=250)
+
+    assert np.array_equal(x, x_r)
+    assert alpha == alpha_r and beta == beta_r
+    assert obj_list == obj_list_r
+    assert data.equals(data_r)
+
+
+
+
+
+def test_resume_of_converged_run_does_not_iterate(tmp_path):
+    A, L, y_delta = _problem()
+    path = str(tmp_path/"run.npz")
+
+    x, alpha, beta, obj_list, data = Algorithm1(A, L, y_delta, checkpoint=path)
+    x_r, alpha_r, beta_r, obj_list_r, data_r = resume(path, A, L, y_delta)
+
+    assert np.array_equal(x, x_r)
+    assert data.equals(data_r)
+
+
+
+
+
+def test_batch_matches_algorithm1():
+    A, L, _ = _problem()
+    Y = np.column_stack([_problem(seed=seed)[2] for seed in range(4)])
+
+    X, alpha, beta, iterations = Algorithm1_batch(spectral_decomposition(A, L), Y)
+
+    for i in range(Y.shape[1]):
+        x, a, b, obj_list, data = Algorithm1(A, L, Y[:, i])
+        assert np.allclose(X[:, i], x, rtol=1e-8, atol=1e-10)
+        assert np.isclose(alpha[i], a, rtol=1e-8)
+        assert np.isclose(beta[i], b, rtol=1e-8)
+        assert iterations[i] == len(data) - 1
+
+
+
+
+
+def test_spectral_path_matches_dense_solves():
+    A, L, y_delta = _problem()
+    lambdas = np.logspace(-8, 0, 9)
+
+    path, summary = parameter_choice(A, L, y_delta, lambdas=lambdas)
+
+    for lmbd, row in zip(lambdas, path.itertuples()):
+        M = A.T@A + lmbd*L.T@L
+        x = np.linalg.solve(M, A.T@y_delta)
+        r = A@x - y_delta
+        assert np.isclose(row.residual, r@r, rtol=1e-6)
+        assert np.isclose(row.penalty, (L@x)@(L@x), rtol=1e-6)
+        assert np.isclose(row.trace, np.trace(A@np.linalg.solve(M, A.T)), rtol=1e-6)